@@ -1,15 +1,27 @@
 import discord
 import json
 import os
+import re
 import math
 import tempfile
+import time
+import functools
 import gzip
+import io
+import signal
+import sqlite3
+import sys
+import threading
+import tracemalloc
+import hashlib
 import shutil
-import urllib.request as urlreq
+from urllib.parse import urlsplit, parse_qs
 import uuid
-import requests
+import logging
+import aiohttp
+from aiohttp import web
 from discord.ext import tasks
-from collections import defaultdict, deque, Counter
+from collections import deque, Counter, OrderedDict
 import asyncio
 from datetime import datetime, timedelta, timezone
 
@@ -17,6 +29,25 @@ from datetime import datetime, timedelta, timezone
 with open('config.json') as config_file:
     config = json.load(config_file)
 
+# Files that should outlive a restart. The app dir is a docker volume and `git reset --hard`
+# leaves untracked files alone, so this survives redeploys.
+CACHE_FOLDER = "cache/"
+if not os.path.exists(CACHE_FOLDER):
+    os.makedirs(CACHE_FOLDER)
+
+def _write_file_atomic(path, data: bytes):
+    # Write next to the target and rename over it, so a crash never leaves a half-written file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
 # --- Spam watchdog config ---
 SPAM_REPORT_CHANNEL_ID = 1327921902223884362
 
@@ -29,8 +60,200 @@ SPAM_MIN_DUPLICATES = 3
 
 SPAM_ACTION_COOLDOWN_SECONDS = 60
 
-_recent_user_messages = defaultdict(lambda: deque())
-_last_spam_action = {}  # (guild_id, user_id) -> datetime
+# Hard limits on watchdog memory
+SPAM_MAX_TRACKED_USERS = 20000      # (guild, user) windows kept at once, least recently active evicted first
+SPAM_MAX_MESSAGES_PER_USER = 50     # records kept in one user's window
+SPAM_SWEEP_INTERVAL_SECONDS = 60
+
+def _monotonic_ms() -> int:
+    # Watchdog clock: integer milliseconds, immune to wall clock jumps
+    return time.monotonic_ns() // 1_000_000
+
+class SpamRecord:
+    """One message in a user's sliding window."""
+    __slots__ = ("ts", "channel_id", "message_id", "payload_sig", "attachments")
+
+    def __init__(self, ts, channel_id, message_id, payload_sig, attachments=None):
+        self.ts = ts  # _monotonic_ms()
+        self.channel_id = channel_id
+        self.message_id = message_id
+        self.payload_sig = payload_sig
+        self.attachments = attachments  # ((url, size, metadata sig), ...) until hashed, else None
+
+class SpamWatchdogState:
+    """
+    Sliding windows of recent messages per (guild_id, user_id), plus the enforcement cooldowns.
+
+    Windows live in an LRU-ordered dict capped at max_users (evictions are counted) and keep
+    at most max_per_user records. A sweep every SPAM_SWEEP_INTERVAL_SECONDS removes idle
+    windows and expired cooldowns, so the state shrinks back when traffic does.
+    """
+    def __init__(self, max_users=SPAM_MAX_TRACKED_USERS, max_per_user=SPAM_MAX_MESSAGES_PER_USER):
+        self.max_users = max_users
+        self.max_per_user = max_per_user
+        self.recent_user_messages = OrderedDict()  # key -> deque[SpamRecord], least recently active first
+        self.last_spam_action = {}                 # key -> ms of the last action, oldest first
+        self.evictions = 0
+        self._next_sweep = 0
+        self.swept_at = None
+
+    def window(self, key, now):
+        bucket = self.recent_user_messages.get(key)
+        if bucket is None:
+            bucket = self.recent_user_messages[key] = deque(maxlen=self.max_per_user)
+            if len(self.recent_user_messages) > self.max_users:
+                self.recent_user_messages.popitem(last=False)
+                self.evictions += 1
+                SPAM_EVICTIONS.inc("windows")
+        else:
+            self.recent_user_messages.move_to_end(key)
+
+        # prune
+        window_start = now - SPAM_WINDOW_SECONDS * 1000
+        while bucket and bucket[0].ts < window_start:
+            bucket.popleft()
+        return bucket
+
+    def drop(self, key):
+        self.recent_user_messages.pop(key, None)
+
+    def cooling_down(self, key, now):
+        last = self.last_spam_action.get(key)
+        return last is not None and now - last < SPAM_ACTION_COOLDOWN_SECONDS * 1000
+
+    def mark_action(self, key, now):
+        # Re-insert so the dict stays ordered by time
+        self.last_spam_action.pop(key, None)
+        self.last_spam_action[key] = now
+
+    def sweep(self, now):
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + SPAM_SWEEP_INTERVAL_SECONDS * 1000
+        self.swept_at = now
+
+        # Both dicts are ordered oldest first, so stop at the first live entry
+        window_start = now - SPAM_WINDOW_SECONDS * 1000
+        windows = self.recent_user_messages
+        while windows:
+            key, bucket = next(iter(windows.items()))
+            if bucket and bucket[-1].ts >= window_start:
+                break
+            del windows[key]
+
+        cooldown_start = now - SPAM_ACTION_COOLDOWN_SECONDS * 1000
+        actions = self.last_spam_action
+        while actions:
+            key, ts = next(iter(actions.items()))
+            if ts >= cooldown_start:
+                break
+            del actions[key]
+
+
+# --- Cross-account spam waves ---
+# Raids where many fresh accounts each post the same payload once never trip the per-user window.
+SPAM_WAVE_ENABLED = True
+SPAM_WAVE_WINDOW_SECONDS = 60
+SPAM_WAVE_MIN_AUTHORS = 5             # distinct accounts posting one payload within the window
+SPAM_WAVE_MIN_CHANNELS = 2            # ... spread over at least this many channels
+SPAM_WAVE_MAX_ACCOUNT_AGE_DAYS = 7    # only accounts created or members joined this recently take part
+SPAM_WAVE_MIN_TEXT_LEN = 20           # shorter text ("lol", "gg") and bare links never count
+SPAM_WAVE_MAX_PAYLOADS = 1024         # payloads tracked per guild, least recently posted evicted first
+SPAM_WAVE_MAX_AUTHORS = 50            # accounts remembered per payload
+SPAM_WAVE_MAX_RECORDS_PER_AUTHOR = 5
+
+class SpamWave:
+    """Accounts that recently posted one payload."""
+    __slots__ = ("last_seen", "authors", "actioned")
+
+    def __init__(self, now):
+        self.last_seen = now
+        self.authors = {}      # user_id -> (author, [SpamRecord])
+        self.actioned = set()  # user_ids already handed to enforcement
+
+class SpamWaveTracker:
+    """
+    Guild-wide heavy-hitters table of payload signatures. Each guild has a fixed-size
+    LRU table keyed by the signature's hash: payloads that keep getting posted stay in it,
+    one-off chatter falls out. All operations are O(1) per message, memory is capped at
+    max_payloads * max_authors records per guild.
+    """
+    def __init__(self, max_payloads=SPAM_WAVE_MAX_PAYLOADS, max_authors=SPAM_WAVE_MAX_AUTHORS):
+        self.max_payloads = max_payloads
+        self.max_authors = max_authors
+        self.guilds = {}  # guild_id -> OrderedDict[payload hash -> SpamWave]
+        self.evictions = 0
+
+    def add(self, guild_id, author, record, now):
+        """Record a post; returns the wave once enough distinct accounts posted the payload."""
+        table = self.guilds.get(guild_id)
+        if table is None:
+            table = self.guilds[guild_id] = OrderedDict()
+
+        # expire from the least recently posted end
+        cutoff = now - SPAM_WAVE_WINDOW_SECONDS * 1000
+        while table:
+            oldest = next(iter(table.values()))
+            if oldest.last_seen >= cutoff:
+                break
+            table.popitem(last=False)
+
+        key = hash(record.payload_sig)
+        wave = table.get(key)
+        if wave is None:
+            wave = table[key] = SpamWave(now)
+            if len(table) > self.max_payloads:
+                table.popitem(last=False)
+                self.evictions += 1
+                SPAM_EVICTIONS.inc("waves")
+        else:
+            wave.last_seen = now
+            table.move_to_end(key)
+
+        entry = wave.authors.get(author.id)
+        if entry is None:
+            if len(wave.authors) >= self.max_authors:
+                # make room by forgetting an account that was already actioned
+                done = next((uid for uid in wave.authors if uid in wave.actioned), None)
+                if done is None:
+                    return None
+                del wave.authors[done]
+                wave.actioned.discard(done)
+            entry = wave.authors[author.id] = (author, [])
+        if len(entry[1]) < SPAM_WAVE_MAX_RECORDS_PER_AUTHOR:
+            entry[1].append(record)
+
+        recent = self.recent_authors(wave, now)
+        if len(recent) < SPAM_WAVE_MIN_AUTHORS:
+            return None
+        channels = {r.channel_id for uid in recent for r in wave.authors[uid][1]}
+        if len(channels) < SPAM_WAVE_MIN_CHANNELS:
+            return None
+        return wave
+
+    def recent_authors(self, wave, now):
+        cutoff = now - SPAM_WAVE_WINDOW_SECONDS * 1000
+        return [uid for uid, (_, records) in wave.authors.items() if records[-1].ts >= cutoff]
+
+    def new_authors(self, wave, now):
+        """(author, records) for every recent account in the wave not actioned yet; marks them."""
+        result = []
+        for uid in self.recent_authors(wave, now):
+            if uid in wave.actioned:
+                continue
+            wave.actioned.add(uid)
+            result.append(wave.authors[uid])
+        return result
+
+    def sweep(self, now):
+        cutoff = now - SPAM_WAVE_WINDOW_SECONDS * 1000
+        for guild_id in list(self.guilds):
+            table = self.guilds[guild_id]
+            while table and next(iter(table.values())).last_seen < cutoff:
+                table.popitem(last=False)
+            if not table:
+                del self.guilds[guild_id]
+
 
 # --- Scam / solicitation pitch watchdog ---
 SCAM_PITCH_ENABLED = True
@@ -76,8 +299,184 @@ SCAM_PITCH_KEYWORDS = [
     "saas",
 ]
 
-def get_decomp_info():
-    frogress_json = json.load(urlreq.urlopen("https://progress.decomp.club/data/rb3/SZBE69_B8/dol/"))
+# --- Metrics ---
+# Prometheus text format, no client library needed. Served with the health checks on
+# METRICS_HOST:METRICS_PORT (see the end of the file); 0 turns the endpoint off.
+METRICS_HOST = config.get("metrics_host", "127.0.0.1")
+METRICS_PORT = config.get("metrics_port", 8000)
+
+FAST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SLOW_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+_metrics = []
+
+def _metric_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+class CounterMetric:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}  # label values -> count
+        _metrics.append(self)
+
+    def inc(self, *label_values, amount=1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def expose(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for label_values, value in self.values.items():
+            yield f"{self.name}{_metric_labels(self.labels, label_values)} {value}"
+
+class HistogramMetric:
+    def __init__(self, name, help, buckets=FAST_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # per bucket, not cumulative; the last one is +Inf
+        self.sum = 0.0
+        _metrics.append(self)
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += value
+
+    def expose(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        total = 0
+        for bound, count in zip((*self.buckets, "+Inf"), self.counts):
+            total += count
+            yield f'{self.name}_bucket{{le="{bound}"}} {total}'
+        yield f"{self.name}_sum {self.sum}"
+        yield f"{self.name}_count {total}"
+
+class GaugeMetric:
+    """Read at scrape time: collect() returns [(label values, value)]."""
+    def __init__(self, name, help, collect, labels=()):
+        self.name = name
+        self.help = help
+        self.collect = collect
+        self.labels = labels
+        _metrics.append(self)
+
+    def expose(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        for label_values, value in self.collect():
+            if math.isnan(value):
+                value = "NaN"
+            elif math.isinf(value):
+                value = "+Inf" if value > 0 else "-Inf"
+            yield f"{self.name}{_metric_labels(self.labels, label_values)} {value}"
+
+def render_metrics() -> str:
+    return "\n".join(line for metric in _metrics for line in metric.expose()) + "\n"
+
+def _timed(histogram):
+    """Decorator: observe how long each call of a coroutine function takes."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+ON_MESSAGE_SECONDS = HistogramMetric("nhx_on_message_seconds", "Time to handle one message, watchdog and reply included.")
+HANDLE_RESPONSE_SECONDS = HistogramMetric("nhx_handle_response_seconds", "Time to send one trigger response.")
+SPAM_WATCHDOG_SECONDS = HistogramMetric("nhx_spam_watchdog_seconds", "Time for the spam watchdog to decide on one message.")
+ACTIONS_CHECK_SECONDS = HistogramMetric("nhx_actions_check_seconds", "Duration of a GitHub Actions staleness check.", SLOW_BUCKETS)
+TRIGGER_HITS = CounterMetric("nhx_trigger_hits_total", "Messages answered with a trigger response.", ("prefix",))
+TRIGGER_MISSES = CounterMetric("nhx_trigger_misses_total", "Commands that matched no trigger.", ("prefix",))
+BUILTIN_COMMANDS_RUN = CounterMetric("nhx_builtin_commands_total", "Built-in commands run.", ("command",))
+SPAM_ACTIONS = CounterMetric("nhx_spam_actions_total", "Softbans queued by the spam watchdog.")
+SPAM_EVICTIONS = CounterMetric("nhx_spam_evictions_total", "Watchdog entries dropped because a size cap was reached.", ("table",))
+ENFORCEMENT_JOBS = CounterMetric(
+    "nhx_enforcement_jobs_total", "Softbans merged into a waiting job (coalesced) or queued after waiting for room (blocked).", ("outcome",))
+RATE_LIMITED = CounterMetric("nhx_rate_limited_total", "HTTP 429 (or rate limit 403) responses.", ("api",))
+
+class _DiscordRateLimitCounter(logging.Handler):
+    # discord.py waits out 429s itself and only logs them, so count the log records.
+    # A global limit also logs "Global rate limit has been hit" for the same response.
+    def emit(self, record):
+        if "responded with 429" in record.getMessage():
+            RATE_LIMITED.inc("discord")
+
+logging.getLogger("discord.http").addHandler(_DiscordRateLimitCounter(logging.WARNING))
+
+# --- HTTP ---
+HTTP_TIMEOUT_SECONDS = 10
+
+_http_session = None
+
+def _get_http_session() -> aiohttp.ClientSession:
+    # One pooled session for every outgoing request; must be called from the event loop
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        _http_session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT_SECONDS))
+    return _http_session
+
+class CachedFetch:
+    """
+    Keeps the last good result of an async fetch. get() answers from memory and, once the value
+    is older than ttl, starts a background refresh (stale-while-revalidate). Only a call with
+    nothing cached yet waits for the fetch. Failed refreshes keep serving the last good value.
+    """
+    def __init__(self, name, fetch, ttl, timeout):
+        self.name = name
+        self.fetch = fetch
+        self.ttl = ttl
+        self.timeout = timeout
+        self.value = None
+        self.fetched_at = None  # time.monotonic() of the last good fetch
+        self.error = None
+        self._refresh = None
+
+    def _start_refresh(self):
+        if self._refresh is None or self._refresh.done():
+            self._refresh = asyncio.create_task(self._run_refresh())
+        return self._refresh
+
+    async def _run_refresh(self):
+        try:
+            value = await asyncio.wait_for(self.fetch(), self.timeout)
+        except Exception as e:
+            self.error = e
+            print(f"{self.name}: refresh failed: {e!r}")
+            return
+        self.value = value
+        self.fetched_at = time.monotonic()
+        self.error = None
+
+    async def get(self):
+        if self.fetched_at is None:
+            # shield: a cancelled caller must not cancel the shared fetch
+            await asyncio.shield(self._start_refresh())
+            if self.fetched_at is None:
+                raise RuntimeError(f"{self.name} unavailable: {self.error!r}")
+        elif time.monotonic() - self.fetched_at >= self.ttl:
+            self._start_refresh()
+        return self.value
+
+# --- Decomp progress ---
+DECOMP_PROGRESS_URL = "https://progress.decomp.club/data/rb3/SZBE69_B8/dol/"
+DECOMP_CACHE_TTL_SECONDS = 300
+DECOMP_FETCH_TIMEOUT_SECONDS = 10
+
+def format_decomp_info(frogress_json):
     # remove wrapper sludge
     frogress_data = frogress_json['rb3']['SZBE69_B8']['dol'][0]
     # Parse the timestamp into a datetime object
@@ -93,249 +492,776 @@ def get_decomp_info():
         "<https://rb3dx.milohax.org/decomp>"
     )
 
+async def _fetch_decomp_info():
+    async with _get_http_session().get(DECOMP_PROGRESS_URL) as resp:
+        resp.raise_for_status()
+        frogress_json = await resp.json(content_type=None)
+    return format_decomp_info(frogress_json)
+
+decomp_progress = CachedFetch("Decomp progress", _fetch_decomp_info, DECOMP_CACHE_TTL_SECONDS, DECOMP_FETCH_TIMEOUT_SECONDS)
+
+async def get_decomp_info():
+    return await decomp_progress.get()
+
 GITHUB_TOKEN = config.get('github_token')
 HEADERS = {'Authorization': f'token {GITHUB_TOKEN}', 'Accept': 'application/vnd.github.v3+json'}
 EXTRA_REPOS = config.get("extra_repos", [])
 IGNORED_REPOS = []
 
+GITHUB_API_URL = "https://api.github.com"
+GITHUB_MAX_CONCURRENCY = 8
+GITHUB_MAX_RETRIES = 3
+GITHUB_MAX_RATE_LIMIT_WAIT = 15 * 60  # longer waits fail the request instead of stalling the run
+GITHUB_CACHE_PATH = os.path.join(CACHE_FOLDER, "github_cache.json")
+GITHUB_CACHE_MAX_AGE_DAYS = 30  # forget URLs that haven't been requested for this long
+
+class GitHubResponseCache:
+    """
+    ETag / Last-Modified cache of GitHub responses, keyed by URL and persisted as JSON.
+    Lets GitHubClient send conditional requests; a 304 is answered from here and
+    doesn't count against the rate limit.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}  # url -> {"etag", "last_modified", "data", "next", "seen"}
+        self.dirty = False
+
+    def load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable GitHub cache {self.path}: {e}")
+
+    def checkpoint(self):
+        """
+        On the event loop: drop old entries and return a copy to save(), or None if nothing
+        changed. Requests keep updating self.entries while the copy is written.
+        """
+        if not self.dirty:
+            return None
+        cutoff = time.time() - GITHUB_CACHE_MAX_AGE_DAYS * 86400
+        self.entries = {url: e for url, e in self.entries.items() if e["seen"] >= cutoff}
+        self.dirty = False
+        return dict(self.entries)
+
+    def save(self, entries):
+        # Blocking; entries comes from checkpoint()
+        _write_file_atomic(self.path, json.dumps(entries, separators=(",", ":")).encode("utf-8"))
+
+    def request_headers(self, url):
+        entry = self.entries.get(url)
+        if entry is None:
+            return {}
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def hit(self, url):
+        """Return (data, next url) for a 304, or None if the entry was pruned meanwhile."""
+        entry = self.entries.get(url)
+        if entry is None:
+            return None
+        entry["seen"] = time.time()
+        self.dirty = True
+        return entry["data"], entry["next"]
+
+    def store(self, url, headers, data, next_url):
+        etag = headers.get("ETag")
+        last_modified = headers.get("Last-Modified")
+        if not etag and not last_modified:
+            return
+        self.entries[url] = {
+            "etag": etag,
+            "last_modified": last_modified,
+            "data": data,
+            "next": next_url,
+            "seen": time.time(),
+        }
+        self.dirty = True
+
+class GitHubError(RuntimeError):
+    """A GitHub request that failed for good (error status, rate limit too far away)."""
+
+class GitHubClient:
+    """
+    Async GitHub REST client on the shared HTTP session. Bounds the number of requests in
+    flight, follows Link pagination and waits out rate limits (Retry-After, X-RateLimit-*).
+    """
+    def __init__(self, headers, cache=None, max_concurrency=GITHUB_MAX_CONCURRENCY):
+        self.headers = headers
+        self.cache = cache
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._quota_reset_at = 0.0  # unix time the exhausted quota resets, 0 if not exhausted
+
+    def _rate_limit_wait(self, status, headers):
+        """Seconds to wait before retrying, or None if the response is final."""
+        exhausted = headers.get("X-RateLimit-Remaining") == "0"
+        if exhausted:
+            self._quota_reset_at = float(headers.get("X-RateLimit-Reset", 0))
+        if status not in (403, 429):
+            return None
+        if not exhausted and "Retry-After" not in headers:
+            return None  # a plain 403 (no access), not a rate limit
+        RATE_LIMITED.inc("github")
+        if "Retry-After" in headers:
+            return float(headers["Retry-After"])
+        if self._quota_reset_at:
+            return max(0.0, self._quota_reset_at - time.time()) + 1
+        return None
+
+    async def get(self, url):
+        """GET a GitHub API URL. Returns (status, decoded JSON or None, next page URL or None)."""
+        return await self._request("GET", url)
+
+    async def graphql(self, query, variables):
+        """Run a GraphQL query and return its data. Per-field errors are logged, not raised."""
+        status, data, _ = await self._request(
+            "POST", f"{GITHUB_API_URL}/graphql", {"query": query, "variables": variables})
+        if status != 200 or not data or data.get("data") is None:
+            raise GitHubError(f"GitHub GraphQL returned {status}: {data and data.get('errors')}")
+        for error in data.get("errors", []):
+            print(f"GitHub GraphQL: {error.get('message')}")
+        return data["data"]
+
+    async def _request(self, method, url, payload=None):
+        # Only GETs are cached; GraphQL POSTs can't be revalidated
+        cache = self.cache if method == "GET" else None
+        conditional = cache is not None
+        for attempt in range(GITHUB_MAX_RETRIES + 1):
+            # Don't spend requests we know will be rejected
+            if self._quota_reset_at:
+                wait = self._quota_reset_at - time.time()
+                if wait > GITHUB_MAX_RATE_LIMIT_WAIT:
+                    raise GitHubError(f"GitHub rate limit exhausted for another {wait:.0f}s")
+                if wait > 0:
+                    await asyncio.sleep(wait + 1)
+                self._quota_reset_at = 0.0
+
+            headers = self.headers
+            if conditional:
+                headers = {**headers, **cache.request_headers(url)}
+
+            async with self._semaphore:
+                async with _get_http_session().request(method, url, headers=headers, json=payload) as resp:
+                    status = resp.status
+                    data = await resp.json(content_type=None) if status == 200 else None
+                    next_link = resp.links.get("next")
+                    next_url = str(next_link["url"]) if next_link else None
+                    wait = self._rate_limit_wait(status, resp.headers)
+                    if status == 200 and cache is not None:
+                        cache.store(url, resp.headers, data, next_url)
+
+            if status == 304 and cache is not None:
+                cached = cache.hit(url)
+                if cached is not None:
+                    data, next_url = cached
+                    return 200, data, next_url
+                # pruned while the request was in flight: ask again without validators
+                conditional = False
+                if attempt < GITHUB_MAX_RETRIES:
+                    continue
+            if wait is None or attempt == GITHUB_MAX_RETRIES:
+                return status, data, next_url
+            if wait > GITHUB_MAX_RATE_LIMIT_WAIT:
+                raise GitHubError(f"GitHub asked to wait {wait:.0f}s for {url}")
+            print(f"GitHub rate limited, retrying {url} in {wait:.0f}s")
+            await asyncio.sleep(wait)
+
+    async def get_all(self, url):
+        """GET every page of a list endpoint."""
+        items = []
+        while url:
+            status, data, next_url = await self.get(url)
+            if status != 200:
+                raise GitHubError(f"GitHub returned {status} for {url}")
+            items.extend(data)
+            url = next_url
+        return items
+
+github_cache = GitHubResponseCache(GITHUB_CACHE_PATH)
+github_cache.load()
+github = GitHubClient(HEADERS, github_cache)
+
 intents = discord.Intents.default()
 intents.message_content = True
-client = discord.Client(intents=intents)
-
-# Load triggers from the JSON files once at startup
-with open('triggers.json') as triggers_file:
-    triggers = json.load(triggers_file)
-
-with open('triggers_esl.json') as triggers_esl_file:
-    triggers_esl = json.load(triggers_esl_file)
-
-with open('triggers_ptbr.json') as triggers_ptbr_file:
-    triggers_ptbr = json.load(triggers_ptbr_file)
-
-# Build mapping from triggers to responses
-triggers_map = {}
-for response in triggers.values():
-    for trigger in response['triggers']:
-        triggers_map[trigger.lower()] = response
-
-# Build mapping from ESL triggers to responses
-triggers_esl_map = {}
-esl_triggers_with_exclamation_map = {}
-for response in triggers_esl.values():
-    for trigger in response['triggers']:
-        if trigger.startswith('!'):
-            # Remove '!' from the trigger
-            esl_triggers_with_exclamation_map[trigger[1:].lower()] = response
-        else:
-            triggers_esl_map[trigger.lower()] = response
-
-    # For linked triggers, map the linked English trigger to this response
-    if 'link' in response:
-        linked_response_number = response['link']
-        if linked_response_number in triggers:
-            linked_response = triggers[linked_response_number]
-            for trigger in linked_response['triggers']:
-                triggers_esl_map[trigger.lower()] = response
-        else:
-            print(f"Linked response number {linked_response_number} not found in English triggers.")
-
-# Build mapping from PT-BR triggers to responses
-triggers_ptbr_map = {}
-ptbr_triggers_with_exclamation_map = {}
-for response in triggers_ptbr.values():
-    for trigger in response['triggers']:
-        if trigger.startswith('!'):
-            # Remove '!' from the trigger
-            ptbr_triggers_with_exclamation_map[trigger[1:].lower()] = response
-        else:
-            triggers_ptbr_map[trigger.lower()] = response
-
-    # For linked triggers, map the linked English trigger to this response
-    if 'link' in response:
-        linked_response_number = response['link']
-        if linked_response_number in triggers:
-            linked_response = triggers[linked_response_number]
-            for trigger in linked_response['triggers']:
-                triggers_ptbr_map[trigger.lower()] = response
-        else:
-            print(f"Linked response number {linked_response_number} not found in English triggers.")
 
+# --- discord.py cache budget ---
+# The bot reads message.author straight from each event and deletes spam by ID, so it needs
+# neither the message cache nor the member cache. "memory_profile": "low" turns both off;
+# "max_messages" (null = no cache) and "member_cache" ("intents" or "none") override it.
+MEMORY_PROFILES = {
+    "default": {"max_messages": 1000, "member_cache": "intents"},
+    "low": {"max_messages": None, "member_cache": "none"},
+}
+MEMORY_PROFILE = config.get("memory_profile", "default")
+if MEMORY_PROFILE not in MEMORY_PROFILES:
+    raise ValueError(f"config: memory_profile must be one of {', '.join(MEMORY_PROFILES)}")
+MAX_MESSAGES = config.get("max_messages", MEMORY_PROFILES[MEMORY_PROFILE]["max_messages"])
+MEMBER_CACHE = config.get("member_cache", MEMORY_PROFILES[MEMORY_PROFILE]["member_cache"])
+if MEMBER_CACHE == "intents":
+    member_cache_flags = discord.MemberCacheFlags.from_intents(intents)
+elif MEMBER_CACHE == "none":
+    member_cache_flags = discord.MemberCacheFlags.none()
+else:
+    raise ValueError("config: member_cache must be \"intents\" or \"none\"")
+
+# --- Sharding ---
+# "shard_count" switches to an AutoShardedClient, one gateway connection per shard
+# ("auto" lets Discord pick the count). "shard_ids" runs only some shards in this process,
+# e.g. [0, 1] or "0-3", so large deployments can split shards over several processes.
+def _parse_shard_ids(value):
+    if value is None:
+        return None
+    if isinstance(value, str):
+        start, sep, end = value.partition("-")
+        return list(range(int(start), int(end) + 1)) if sep else [int(start)]
+    return [int(shard_id) for shard_id in value]
+
+SHARD_COUNT = config.get("shard_count")
+SHARD_IDS = _parse_shard_ids(config.get("shard_ids"))
+
+if SHARD_COUNT is None:
+    client = discord.Client(intents=intents, max_messages=MAX_MESSAGES, member_cache_flags=member_cache_flags)
+else:
+    if SHARD_IDS is not None:
+        if not isinstance(SHARD_COUNT, int):
+            raise ValueError("config: shard_ids needs a numeric shard_count")
+        if any(not 0 <= shard_id < SHARD_COUNT for shard_id in SHARD_IDS):
+            raise ValueError(f"config: shard_ids must be between 0 and {SHARD_COUNT - 1}")
+    client = discord.AutoShardedClient(
+        intents=intents,
+        max_messages=MAX_MESSAGES,
+        member_cache_flags=member_cache_flags,
+        shard_count=None if SHARD_COUNT == "auto" else SHARD_COUNT,
+        shard_ids=SHARD_IDS,
+    )
 
-TEMP_FOLDER = "out/"
-if not os.path.exists(TEMP_FOLDER):
-    os.makedirs(TEMP_FOLDER)
+# --- Trigger index ---
+TRIGGER_FILES = ('triggers.json', 'triggers_esl.json', 'triggers_ptbr.json')
+
+# Poll the trigger files this often and hot-swap the index when they change (0 = load once at startup)
+TRIGGER_RELOAD_SECONDS = config.get("trigger_reload_seconds", 0)
+
+def _check_trigger_file(name, responses):
+    """Raise ValueError for structural problems that would break the maps or handle_response."""
+    if not isinstance(responses, dict):
+        raise ValueError(f"{name}: top level must be an object")
+    for key, response in responses.items():
+        if not isinstance(response, dict):
+            raise ValueError(f"{name}: {key} must be an object")
+        trigger_list = response.get('triggers')
+        if not isinstance(trigger_list, list) or not all(isinstance(t, str) for t in trigger_list):
+            raise ValueError(f"{name}: {key} needs a list of string triggers")
+        if not isinstance(response.get('text', ""), str):
+            raise ValueError(f"{name}: {key} text must be a string")
+        if not isinstance(response.get('files', []), list):
+            raise ValueError(f"{name}: {key} files must be a list")
+        if response.get('format') not in (None, "plain", "embed"):
+            raise ValueError(f"{name}: {key} format must be \"plain\" or \"embed\"")
+
+def _build_language_maps(name, responses, triggers, problems):
+    # Build mapping from ESL/PT-BR triggers to responses
+    language_map = {}
+    with_exclamation_map = {}
+    for response in responses.values():
+        for trigger in response['triggers']:
+            if trigger.startswith('!'):
+                # Remove '!' from the trigger
+                with_exclamation_map[trigger[1:].lower()] = response
+            else:
+                language_map[trigger.lower()] = response
+
+        # For linked triggers, map the linked English trigger to this response
+        if 'link' in response:
+            linked_response_number = response['link']
+            if linked_response_number in triggers:
+                linked_response = triggers[linked_response_number]
+                for trigger in linked_response['triggers']:
+                    language_map[trigger.lower()] = response
+            else:
+                problems.append(f"{name}: linked response number {linked_response_number} not found in English triggers.")
+
+    return language_map, with_exclamation_map
+
+class TriggerIndex:
+    """
+    Everything derived from the trigger files. An index is never mutated after it is built;
+    reloading builds a new one and swaps the global, so in-flight messages keep the old one.
+    """
+    def __init__(self, triggers, triggers_esl, triggers_ptbr):
+        for name, responses in zip(TRIGGER_FILES, (triggers, triggers_esl, triggers_ptbr)):
+            _check_trigger_file(name, responses)
 
-# Constants
+        self.triggers = triggers
+        self.triggers_esl = triggers_esl
+        self.triggers_ptbr = triggers_ptbr
+        self.problems = []
+
+        # Build mapping from triggers to responses
+        self.triggers_map = {}
+        for response in triggers.values():
+            for trigger in response['triggers']:
+                self.triggers_map[trigger.lower()] = response
+
+        self.triggers_esl_map, self.esl_triggers_with_exclamation_map = _build_language_maps(
+            'triggers_esl.json', triggers_esl, triggers, self.problems)
+        self.triggers_ptbr_map, self.ptbr_triggers_with_exclamation_map = _build_language_maps(
+            'triggers_ptbr.json', triggers_ptbr, triggers, self.problems)
+
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        for name, responses in zip(TRIGGER_FILES, (triggers, triggers_esl, triggers_ptbr)):
+            for key, response in responses.items():
+                for file in response.get('files', []):
+                    if not os.path.exists(os.path.join(base_dir, file)):
+                        self.problems.append(f"{name}: {key} references missing file {file}")
+
+        # Stable names for responses ("en:response28"), used to key per-response state
+        self.response_keys = {}
+        for lang, responses in (("en", triggers), ("esl", triggers_esl), ("ptbr", triggers_ptbr)):
+            for key, response in responses.items():
+                self.response_keys[id(response)] = f"{lang}:{key}"
+
+        self.command_dispatch = build_command_dispatch(
+            self.triggers_map, self.triggers_esl_map, self.triggers_ptbr_map,
+            self.esl_triggers_with_exclamation_map, self.ptbr_triggers_with_exclamation_map,
+        )
+        self.list_pages = build_trigger_list_pages(triggers, triggers_esl)
+        self.suggesters = {prefix: CommandSuggester(table) for prefix, table in self.command_dispatch.items()}
+
+def _trigger_files_signature():
+    signature = []
+    for name in TRIGGER_FILES:
+        st = os.stat(name)
+        signature.append((st.st_mtime_ns, st.st_size))
+    return tuple(signature)
+
+def load_trigger_index():
+    """Read and index the trigger files. Blocking; run it in a thread once the bot is up."""
+    signature = _trigger_files_signature()
+    loaded = []
+    for name in TRIGGER_FILES:
+        with open(name, encoding='utf-8') as triggers_file:
+            loaded.append(json.load(triggers_file))
+    return signature, TriggerIndex(*loaded)
+
+# Commands answered by the bot itself; these work with every prefix and win over triggers
+BUILTIN_COMMANDS = {
+    'actions': 'actions',
+    'ping': 'ping',
+    'list': 'list',
+    'triggers': 'list',
+    'commands': 'list',
+    'help': 'list',
+    'cmd': 'list',
+    'cmds': 'list',
+    'hugh': 'progress',
+    'progress': 'progress',
+    'misses': 'misses',
+    'memory': 'memory',
+    'profile': 'profile',
+    'memsnap': 'memsnap',
+    'usage': 'usage',
+}
+
+def _is_staff(user) -> bool:
+    # Same bar as the spam watchdog's exemption; DMs have no permissions
+    perms = getattr(user, "guild_permissions", None)
+    if perms is None:
+        return False
+    return perms.administrator or perms.manage_guild or perms.manage_messages or perms.ban_members or perms.kick_members
+
+def _is_admin(user) -> bool:
+    perms = getattr(user, "guild_permissions", None)
+    return perms is not None and (perms.administrator or perms.manage_guild)
+
+# Built-in commands that need a permission check; never offered as suggestions
+COMMAND_PERMISSIONS = {
+    'misses': _is_staff,
+    'memory': _is_admin,
+    'profile': _is_admin,
+    'memsnap': _is_admin,
+    'usage': _is_admin,
+}
+
+# The command is the first word starting with one of the prefixes ('!', '¡', '@')
+COMMAND_RE = re.compile(r'(?<!\S)([!¡@])(\S*)')
+
+def build_command_dispatch(triggers_map, triggers_esl_map, triggers_ptbr_map,
+                           esl_triggers_with_exclamation_map, ptbr_triggers_with_exclamation_map):
+    """
+    Merge the built-in commands and every language map into one lookup table per prefix.
+    Values are either the name of a built-in command or a trigger response.
+    """
+    # '!' falls back to the ESL/PT-BR '!' triggers, English wins on conflicts
+    english = {**ptbr_triggers_with_exclamation_map, **esl_triggers_with_exclamation_map, **triggers_map}
+    dispatch = {
+        '!': english,
+        '¡': dict(triggers_esl_map),
+        '@': dict(triggers_ptbr_map),
+    }
+    for table in dispatch.values():
+        table.update(BUILTIN_COMMANDS)
+    return dispatch
+
+# --- Did you mean ---
+SUGGEST_MAX_RESULTS = 3
+SUGGEST_CANDIDATES = 20  # names sharing the most bigrams, re-ranked by edit distance
+
+def _bigrams(name):
+    padded = f"^{name}$"
+    return {padded[i:i + 2] for i in range(len(padded) - 1)}
+
+def _edit_distance(a, b, limit):
+    # Levenshtein distance that also counts swapping two adjacent characters as one edit;
+    # gives up with limit + 1 as soon as the distance must be larger than limit
+    prev2, prev = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+        if min(cur) > limit and (prev2 is None or min(prev) > limit):
+            return limit + 1
+        prev2, prev = prev, cur
+    return prev[-1]
+
+class CommandSuggester:
+    """
+    Bigram index over the command names of one prefix. A lookup only looks at names that share
+    a bigram with the query and computes edit distances for the best few, so it costs about
+    the same for ten names as for ten thousand.
+    """
+    def __init__(self, table):
+        self.names = []
+        self.targets = []
+        self.gram_counts = []
+        self.postings = {}  # bigram -> indexes into names
+        for name, target in table.items():
+            if not name or (isinstance(target, str) and target in COMMAND_PERMISSIONS):
+                continue
+            index = len(self.names)
+            self.names.append(name)
+            self.targets.append(target)
+            grams = _bigrams(name)
+            self.gram_counts.append(len(grams))
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(index)
+
+    def suggest(self, query, limit=SUGGEST_MAX_RESULTS):
+        query_grams = _bigrams(query)
+        shared = Counter()
+        for gram in query_grams:
+            for index in self.postings.get(gram, ()):
+                shared[index] += 1
+
+        # "bgh" -> "bgh3" is one edit, long names tolerate more typos
+        max_distance = max(1, len(query) // 3)
+        ranked = []
+        for index, count in shared.most_common(SUGGEST_CANDIDATES):
+            name = self.names[index]
+            # An edit changes at most three bigrams (two for insert/delete/replace, three for a swap),
+            # so most candidates are ruled out before computing the distance
+            if (abs(len(name) - len(query)) > max_distance
+                    or count < max(len(query_grams), self.gram_counts[index]) - 3 * max_distance):
+                continue
+            distance = _edit_distance(query, name, max_distance)
+            if distance <= max_distance:
+                ranked.append((distance, -count, name, index))
+        ranked.sort()
+
+        # One suggestion per response, not every alias of it
+        results = []
+        seen = set()
+        for _, _, name, index in ranked:
+            target = self.targets[index]
+            key = target if isinstance(target, str) else id(target)
+            if key in seen:
+                continue
+            seen.add(key)
+            results.append(name)
+            if len(results) == limit:
+                break
+        return results
+
+# --- !list pages ---
 COLUMNS = 3  # Number of columns to display
 COLUMNS_ALIAS = 2  # Number of columns to display for aliases
-EMBED_TIMEOUT = 60  # Timeout in seconds
+LIST_TITLE = "Available Triggers"
+
+def _items_per_column(total_items):
+    if total_items <= 15:
+        return max(3, math.ceil(total_items / COLUMNS))
+    elif total_items <= 30:
+        return 5
+    elif total_items <= 60:
+        return 6
+    else:
+        return 9
+
+def _list_page_embeds(title, field_name, columns, items, per_column, format_item):
+    per_page = per_column * columns
+    total_pages = max(1, math.ceil(len(items) / per_page))
+    pages = []
+    for page in range(total_pages):
+        embed = discord.Embed(title=title, color=discord.Color.blue())
+        items_page = items[page * per_page:(page + 1) * per_page]
+        for i in range(columns):
+            col = items_page[i * per_column:(i + 1) * per_column]
+            value = "\n".join(format_item(item) for item in col) if col else "\u200B"
+            embed.add_field(name=field_name if i == 0 else "\u200B", value=value, inline=True)
+        pages.append(embed)
+    return tuple(pages)
+
+def build_trigger_list_pages(triggers, triggers_esl):
+    """
+    Build every !list page once per trigger set. Returns {False: trigger pages, True: alias pages};
+    the embeds are shared by every !list message and must not be modified.
+    """
+    # Collect English triggers and aliases
+    english_triggers = []
+    english_aliases_dict = {}
+    for value in triggers.values():
+        if value['triggers']:
+            original_trigger = value['triggers'][0]
+            english_triggers.append(original_trigger)
+            if len(value['triggers']) > 1:
+                english_aliases_dict[original_trigger] = value['triggers'][1:]
+
+    # Collect Spanish triggers and aliases
+    spanish_triggers = []
+    spanish_aliases_dict = {}
+    for value in triggers_esl.values():
+        if value['triggers']:
+            original_trigger = value['triggers'][0]
+            spanish_triggers.append(original_trigger)
+            if len(value['triggers']) > 1:
+                spanish_aliases_dict[original_trigger] = value['triggers'][1:]
+
+    # Remove duplicates and sort triggers
+    english_triggers = sorted(set(english_triggers))
+    spanish_triggers = sorted(set(spanish_triggers))
+    english_aliases_dict = {key: sorted(english_aliases_dict[key]) for key in sorted(english_aliases_dict)}
+    spanish_aliases_dict = {key: sorted(spanish_aliases_dict[key]) for key in sorted(spanish_aliases_dict)}
+
+    # Combine English and Spanish triggers
+    unique_triggers = english_triggers + spanish_triggers
+    alias_items = list({**english_aliases_dict, **spanish_aliases_dict}.items())
+
+    # Both views use the column height of the trigger view
+    per_column = _items_per_column(len(unique_triggers))
+    return {
+        False: _list_page_embeds(LIST_TITLE, "Triggers", COLUMNS, unique_triggers, per_column, str),
+        True: _list_page_embeds(
+            f"{LIST_TITLE} - Aliases", "Aliases", COLUMNS_ALIAS, alias_items, per_column,
+            lambda item: f"**{item[0]}**\n{', '.join(item[1])}",
+        ),
+    }
+
+# Load triggers from the JSON files at startup
+trigger_files_signature, trigger_index = load_trigger_index()
+for problem in trigger_index.problems:
+    print(problem)
+
+@tasks.loop(seconds=max(1, TRIGGER_RELOAD_SECONDS))
+async def watch_trigger_files():
+    global trigger_files_signature, trigger_index
+
+    try:
+        signature = await asyncio.to_thread(_trigger_files_signature)
+    except OSError as e:
+        print(f"Trigger reload: can't stat trigger files: {e}")
+        return
+    if signature == trigger_files_signature:
+        return
+
+    try:
+        signature, new_index = await asyncio.to_thread(load_trigger_index)
+    except Exception as e:
+        # Half-saved or broken JSON: keep serving the current index and retry on the next change
+        print(f"Trigger reload rejected: {e}")
+        trigger_files_signature = signature
+        return
+
+    new_problems = [p for p in new_index.problems if p not in trigger_index.problems]
+    trigger_files_signature = signature
+    if new_problems:
+        print("Trigger reload rejected:\n" + "\n".join(new_problems))
+        return
+
+    # Plain rebinding is atomic for the event loop; handlers that already read the old index keep it
+    trigger_index = new_index
+    print(f"Reloaded triggers ({len(new_index.triggers_map)} English triggers)")
+
+
+TEMP_FOLDER = "out/"
+if not os.path.exists(TEMP_FOLDER):
+    os.makedirs(TEMP_FOLDER)
 
 def generate_session_hash():
     return str(uuid.uuid4())[:8]  # Generate a short unique hash
 
-class PaginatorView(discord.ui.View):
-    def __init__(self, triggers, alias_triggers_dict, user_id, show_aliases=False, title="Available Triggers"):
-        super().__init__(timeout=EMBED_TIMEOUT)
-        self.triggers = triggers
-        self.alias_triggers_dict = alias_triggers_dict
-        self.user_id = user_id
+class ListPageButton(discord.ui.DynamicItem[discord.ui.Button], template=r'nhxlist:(?P<action>mode|prev|next):(?P<aliases>[01]):(?P<page>[0-9]+):(?P<user_id>[0-9]+)'):
+    """
+    A !list button. The list's mode, page and owner live in the custom_id, so one registered
+    class serves every list message, nothing is kept per message and buttons survive restarts.
+    """
+    def __init__(self, action, show_aliases, page, user_id, style=discord.ButtonStyle.secondary, label=None, disabled=False):
+        super().__init__(discord.ui.Button(
+            style=style,
+            label=label,
+            disabled=disabled,
+            custom_id=f"nhxlist:{action}:{int(show_aliases)}:{page}:{user_id}",
+        ))
+        self.action = action
         self.show_aliases = show_aliases
-        self.title = title
-        self.current_page = 0
-        self.items_per_page = self.calculate_items_per_page()
-        self.total_pages = self.calculate_total_pages()
-        self.add_buttons()
-
-    def calculate_items_per_page(self):
-        total_items = len(self.current_items)
-        if total_items <= 15:
-            return max(3, math.ceil(total_items / COLUMNS))
-        elif total_items <= 30:
-            return 5
-        elif total_items <= 60:
-            return 6
-        else:
-            return 9
-
-    def calculate_total_pages(self):
-        items_count = len(self.current_items)
-        return max(1, math.ceil(items_count / (self.items_per_page * (COLUMNS if not self.show_aliases else COLUMNS_ALIAS))))
-
-    @property
-    def current_items(self):
-        if self.show_aliases:
-            return [(trigger, aliases) for trigger, aliases in self.alias_triggers_dict.items() if aliases]
-        return self.triggers
-
-    def add_buttons(self):
-        self.clear_items()
-        if self.show_aliases:
-            self.add_item(ViewTriggersButton(style=discord.ButtonStyle.secondary, label='Show Triggers', user_id=self.user_id))
-        else:
-            self.add_item(ViewAliasesButton(style=discord.ButtonStyle.secondary, label='Show Aliases', user_id=self.user_id))
-        
-        if self.current_page > 0:
-            self.add_item(PreviousButton(style=discord.ButtonStyle.primary, label='Previous', user_id=self.user_id))
-        else:
-            self.add_item(PreviousButton(style=discord.ButtonStyle.secondary, label='Previous', disabled=True, user_id=self.user_id))
-        
-        if self.current_page < self.total_pages - 1 and self.has_next_page_items():
-            self.add_item(NextButton(style=discord.ButtonStyle.primary, label='Next', user_id=self.user_id))
-        else:
-            self.add_item(NextButton(style=discord.ButtonStyle.secondary, label='Next', disabled=True, user_id=self.user_id))
-
-    def update_buttons(self):
-        self.add_buttons()
-
-    def get_embed(self):
-        embed = discord.Embed(title=self.title if not self.show_aliases else f"{self.title} - Aliases", color=discord.Color.blue())
-        
-        start_idx = self.current_page * self.items_per_page * (COLUMNS if not self.show_aliases else COLUMNS_ALIAS)
-        end_idx = start_idx + self.items_per_page * (COLUMNS if not self.show_aliases else COLUMNS_ALIAS)
-        
-        if self.show_aliases:
-            items_page = self.current_items[start_idx:end_idx]
-            alias_columns = [items_page[i * self.items_per_page:(i + 1) * self.items_per_page] for i in range(COLUMNS_ALIAS)]
-            
-            for i, col in enumerate(alias_columns):
-                if col:
-                    value = "\n".join(f"**{trigger}**\n{', '.join(aliases)}" for trigger, aliases in col)
-                else:
-                    value = "\u200B"
-                embed.add_field(name="Aliases" if i == 0 else "\u200B", value=value, inline=True)
-        else:
-            items_page = self.current_items[start_idx:end_idx]
-            trigger_columns = [items_page[i * self.items_per_page:(i + 1) * self.items_per_page] for i in range(COLUMNS)]
-
-            for i, col in enumerate(trigger_columns):
-                if col:
-                    value = "\n".join(col)
-                else:
-                    value = "\u200B"
-                embed.add_field(name="Triggers" if i == 0 else "\u200B", value=value, inline=True)
-
-        return embed
-
-    def has_next_page_items(self):
-        # Check if there are items on the next page
-        next_page_idx = (self.current_page + 1) * self.items_per_page * (COLUMNS if not self.show_aliases else COLUMNS_ALIAS)
-        return next_page_idx < len(self.current_items)
-
-    async def on_timeout(self):
-        # Disable all buttons after timeout
-        for item in self.children:
-            item.disabled = True
-        # Edit the message to update the disabled state of the buttons
-        await self.message.edit(view=self)
-
-class NextButton(discord.ui.Button):
-    def __init__(self, *args, **kwargs):
-        self.user_id = kwargs.pop('user_id')
-        super().__init__(*args, **kwargs)
+        self.page = page
+        self.user_id = user_id
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match):
+        return cls(match['action'], match['aliases'] == '1', int(match['page']), int(match['user_id']))
 
     async def callback(self, interaction: discord.Interaction):
         if interaction.user.id != self.user_id:
             await interaction.response.send_message("You did not trigger this list. Use !list to browse through commands.", ephemeral=True)
             return
-        view: PaginatorView = self.view
-        view.current_page += 1
-        embed = view.get_embed()
-        view.update_buttons()
-        await interaction.response.edit_message(embed=embed, view=view)
 
-class PreviousButton(discord.ui.Button):
-    def __init__(self, *args, **kwargs):
-        self.user_id = kwargs.pop('user_id')
-        super().__init__(*args, **kwargs)
+        show_aliases = self.show_aliases
+        page = self.page
+        if self.action == 'mode':
+            show_aliases = not show_aliases
+            page = 0  # Reset to the first page
+        elif self.action == 'prev':
+            page -= 1
+        else:
+            page += 1
 
-    async def callback(self, interaction: discord.Interaction):
-        if interaction.user.id != self.user_id:
-            await interaction.response.send_message("You did not trigger this list. Use !list to browse through commands.", ephemeral=True)
-            return
-        view: PaginatorView = self.view
-        view.current_page -= 1
-        embed = view.get_embed()
-        view.update_buttons()
-        await interaction.response.edit_message(embed=embed, view=view)
+        # The trigger set may have been reloaded since this list was sent
+        pages = trigger_index.list_pages[show_aliases]
+        page = max(0, min(page, len(pages) - 1))
+        await interaction.response.edit_message(embed=pages[page], view=list_page_view(pages, show_aliases, page, self.user_id))
 
-class ViewAliasesButton(discord.ui.Button):
-    def __init__(self, *args, **kwargs):
-        self.user_id = kwargs.pop('user_id')
-        super().__init__(*args, **kwargs)
+def list_page_view(pages, show_aliases, page, user_id):
+    view = discord.ui.View(timeout=None)
+    if show_aliases:
+        view.add_item(ListPageButton('mode', show_aliases, page, user_id, label='Show Triggers'))
+    else:
+        view.add_item(ListPageButton('mode', show_aliases, page, user_id, label='Show Aliases'))
 
-    async def callback(self, interaction: discord.Interaction):
-        if interaction.user.id != self.user_id:
-            await interaction.response.send_message("You did not trigger this list. Use !list to browse through commands.", ephemeral=True)
-            return
-        view: PaginatorView = self.view
-        view.show_aliases = True
-        view.current_page = 0  # Reset to the first page
-        embed = view.get_embed()
-        view.update_buttons()
-        await interaction.response.edit_message(embed=embed, view=view)
-
-class ViewTriggersButton(discord.ui.Button):
-    def __init__(self, *args, **kwargs):
-        self.user_id = kwargs.pop('user_id')
-        super().__init__(*args, **kwargs)
+    if page > 0:
+        view.add_item(ListPageButton('prev', show_aliases, page, user_id, style=discord.ButtonStyle.primary, label='Previous'))
+    else:
+        view.add_item(ListPageButton('prev', show_aliases, page, user_id, label='Previous', disabled=True))
 
-    async def callback(self, interaction: discord.Interaction):
-        if interaction.user.id != self.user_id:
-            await interaction.response.send_message("You did not trigger this list. Use !list to browse through commands.", ephemeral=True)
-            return
-        view: PaginatorView = self.view
-        view.show_aliases = False
-        view.current_page = 0  # Reset to the first page
-        embed = view.get_embed()
-        view.update_buttons()
-        await interaction.response.edit_message(embed=embed, view=view)
+    if page < len(pages) - 1:
+        view.add_item(ListPageButton('next', show_aliases, page, user_id, style=discord.ButtonStyle.primary, label='Next'))
+    else:
+        view.add_item(ListPageButton('next', show_aliases, page, user_id, label='Next', disabled=True))
+    return view
+
+client.add_dynamic_items(ListPageButton)
+
+# --- Health and metrics endpoint ---
+def _gateway_latencies():
+    if isinstance(client, discord.AutoShardedClient):
+        return [((shard_id,), latency) for shard_id, latency in client.latencies]
+    return [((0,), client.latency)]
+
+GaugeMetric("nhx_gateway_latency_seconds", "Gateway heartbeat latency per shard.", _gateway_latencies, ("shard",))
+GaugeMetric("nhx_enforcement_queue_depth", "Softbans waiting for a worker.",
+            lambda: [((), sum(len(shard.enforcement.pending) for shard in _shard_states.values()))])
+GaugeMetric("nhx_ready", "1 once connected to Discord.", lambda: [((), int(client.is_ready() and not client.is_closed()))])
+
+async def _metrics_handler(request):
+    return web.Response(text=render_metrics(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+async def _healthz_handler(request):
+    # Liveness: getting an answer at all means the event loop isn't stuck
+    return web.Response(text="ok")
+
+async def _readyz_handler(request):
+    if client.is_ready() and not client.is_closed():
+        return web.Response(text="ready")
+    return web.Response(status=503, text="not connected")
+
+def build_metrics_app() -> web.Application:
+    app = web.Application()
+    app.router.add_get("/metrics", _metrics_handler)
+    app.router.add_get("/healthz", _healthz_handler)
+    app.router.add_get("/readyz", _readyz_handler)
+    return app
+
+async def start_metrics_server():
+    runner = web.AppRunner(build_metrics_app(), access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, METRICS_HOST, METRICS_PORT).start()
+    except OSError as e:
+        print(f"Metrics endpoint not started on {METRICS_HOST}:{METRICS_PORT}: {e}")
+        await runner.cleanup()
+        return None
+    print(f"Metrics and health checks on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    return runner
+
+_metrics_runner = None
+
+@client.event
+async def setup_hook():
+    # docker stop sends SIGTERM: close cleanly so the shutdown snapshot gets written
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, lambda: asyncio.create_task(client.close()))
+    except (NotImplementedError, AttributeError):
+        pass  # Windows
+
+    # Up before the gateway connects, so liveness checks pass during login
+    global _metrics_runner
+    if METRICS_PORT and _metrics_runner is None:
+        _metrics_runner = await start_metrics_server()
+
+async def _close_client(close=client.close):
+    """client.close, then the bot's own connections; SIGTERM, Ctrl+C and client.run's exit all end here."""
+    global _metrics_runner
+    await close()
+    if _metrics_runner is not None:
+        await _metrics_runner.cleanup()
+        _metrics_runner = None
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+
+client.close = _close_client
+
+_snapshot_restored = False
 
 @client.event
 async def on_ready():
+    global _snapshot_restored
     print(f'Logged in as {client.user}!')
     check_actions_staleness.start()   # kick off the daily loop
+    if TRIGGER_RELOAD_SECONDS > 0 and not watch_trigger_files.is_running():
+        watch_trigger_files.start()
+
+    # Guilds are cached by now, so restored state lands on the right shard
+    if SNAPSHOT_INTERVAL_SECONDS > 0 and not _snapshot_restored:
+        _snapshot_restored = True
+        snapshot = await asyncio.to_thread(load_snapshot)
+        if snapshot is not None:
+            await restore_snapshot(snapshot)
+        if not checkpoint_snapshot.is_running():
+            checkpoint_snapshot.start()
+
+    if USAGE_FLUSH_SECONDS > 0 and not flush_usage_loop.is_running():
+        flush_usage_loop.start()
 
 @client.event
+@_timed(ON_MESSAGE_SECONDS)
 async def on_message(message):
     if message.author == client.user:
         return
@@ -357,264 +1283,1227 @@ async def on_message(message):
             print(f"Failed to publish message {message.id} in channel {message.channel.id}: {e}")
         return
 
-    message_content = message.content.strip()
-    if not message_content:
+    # Most traffic is chatter; a single regex scan rejects it without allocating
+    match = COMMAND_RE.search(message.content)
+    if match is None:
         return
 
-    # Normalize the message content to lower case
-    message_content_lower = message_content.lower()
+    # Hold on to one index for the whole message, even if a reload swaps it meanwhile
+    index = trigger_index
 
-    # List of valid prefixes
-    prefixes = ['!', '¡', '@']
+    prefix = match.group(1)
+    command = match.group(2).lower()
 
-    # Check for commands anywhere in the message
-    words = message_content_lower.split()
+    target = index.command_dispatch[prefix].get(command)
+    if target is None:
+        print(f"Command '{prefix}{command}' not found.")
+        await _answer_unknown_command(message, index, prefix, command)
+        return
 
-    for word in words:
-        if any(word.startswith(prefix) for prefix in prefixes):
-            # Identify the prefix used
-            for prefix in prefixes:
-                if word.startswith(prefix):
-                    command = word[len(prefix):].strip()
-                    break
+    if isinstance(target, str):
+        allowed = COMMAND_PERMISSIONS.get(target)
+        if allowed is not None and not allowed(message.author):
+            return
+        BUILTIN_COMMANDS_RUN.inc(target)
+        await run_builtin_command(message, target, index)
+        return
 
-            if command == 'actions':
-                await check_actions_staleness()  # manual trigger
-                return
-            
-            if command == 'ping':
-                before = datetime.utcnow()
-                msg = await message.channel.send("🏓 Pong?")
-                after = datetime.utcnow()
-
-                rtt_ms = (after - before).total_seconds() * 1000
-                ws_ms = client.latency * 1000
-
-                await msg.edit(
-                    content=f"🏓 **Pong!**\n"
-                            f"WebSocket latency: `{ws_ms:.1f} ms`\n"
-                            f"Round-trip latency: `{rtt_ms:.1f} ms`"
-                )
-                return
-
-            # Handle special commands like list
-            if command in ["list", "triggers", "commands", "help", "cmd", "cmds"]:
-                await send_trigger_list(message.channel, message.author.id)
-                return
-
-            if command in ['hugh', 'progress']:
-                await message.channel.send(get_decomp_info())
-                return
-
-            # Now handle triggers
-            if prefix in ['!']:
-                # Process English triggers
-                await process_trigger(message.channel, command, triggers_map, esl_triggers_with_exclamation_map, ptbr_triggers_with_exclamation_map)
-                return  # Exit after processing a command
-            elif prefix == '¡':
-                # Process ESL triggers
-                await process_esl_trigger(message.channel, command, triggers_esl_map)
-                return  # Exit after processing a command
-            elif prefix == '@':
-                # Process PT-BR triggers
-                await process_ptbr_trigger(message.channel, command, triggers_ptbr_map)
-                return # Exit after processing a command
+    TRIGGER_HITS.inc(prefix)
+    response_key = index.response_keys[id(target)]
+    _record_usage(response_key, message.channel.id)
 
-@tasks.loop(hours=24)
-async def check_actions_staleness():
-    """
-    Checks all repos under nsneverhax (minus IGNORED_REPOS) + any EXTRA_REPOS
-    for their most recent GitHub Actions run. If the latest run is 89 days or older,
-    reports it to the designated channel.
-    """
-    stale = []
+    if TRIGGER_COOLDOWN_SECONDS <= 0:
+        await handle_response(message.channel, target)
+        return
 
-    # 1) List all nsneverhax repos
-    repos_url = "https://api.github.com/users/nsneverhax/repos?per_page=100"
-    resp = requests.get(repos_url, headers=HEADERS)
-    resp.raise_for_status()
+    # Several people asking for the same thing at once get one answer
+    recent_replies = shard_state(message.guild).recent_replies
+    reply_key = (message.channel.id, response_key)
+    recent = _claim_trigger_reply(recent_replies, reply_key)
+    if recent is not None:
+        await _answer_repeat_trigger(message, recent)
+        return
 
-    # build a list of (owner, name), skipping ignored
-    monitored = [
-        ("nsneverhax", r["name"])
-        for r in resp.json()
-        if r["name"] not in IGNORED_REPOS
-    ]
+    try:
+        sent = await handle_response(message.channel, target)
+    except Exception:
+        recent_replies.pop(reply_key, None)
+        raise
+    if sent is not None and reply_key in recent_replies:
+        recent_replies[reply_key][1] = sent.jump_url
+
+PING_MAX_SHARD_LINES = 10
+
+def _websocket_latency_text(guild):
+    if not isinstance(client, discord.AutoShardedClient):
+        return f"WebSocket latency: `{client.latency * 1000:.1f} ms`"
+
+    # Every shard has its own gateway connection
+    this_shard = guild.shard_id if guild else 0
+    latencies = sorted(client.latencies)
+    if len(latencies) <= PING_MAX_SHARD_LINES:
+        return "\n".join(
+            f"Shard {shard_id}{' (this server)' if shard_id == this_shard else ''} WebSocket latency: `{latency * 1000:.1f} ms`"
+            for shard_id, latency in latencies
+        )
+    values = [latency * 1000 for _, latency in latencies]
+    own = dict(latencies).get(this_shard, float("nan")) * 1000
+    return (
+        f"Shard {this_shard} (this server) WebSocket latency: `{own:.1f} ms`\n"
+        f"{len(values)} shards in this process: avg `{sum(values) / len(values):.1f} ms`, max `{max(values):.1f} ms`"
+    )
 
-    # 2) Add any extras from config
-    for repo_full in EXTRA_REPOS:
-        if "/" in repo_full:
-            owner, name = repo_full.split("/", 1)
-        else:
-            owner, name = "nsneverhax", repo_full
-        if (owner, name) not in monitored:
-            monitored.append((owner, name))
+# --- Unknown commands ---
+# Reply to a command that doesn't exist with the closest triggers, if any are close enough
+SUGGEST_ENABLED = config.get("did_you_mean", True)
+MISSES_MAX_TRACKED = 2000
+MISSES_REPORT_SIZE = 25
+
+_command_misses = Counter()  # "!command" -> times asked for since startup (kept in the snapshot)
+
+def _count_command_miss(name):
+    _command_misses[name] += 1
+    if len(_command_misses) > MISSES_MAX_TRACKED:
+        # keep the most asked-for half; one-off typos fall out
+        keep = _command_misses.most_common(MISSES_MAX_TRACKED // 2)
+        _command_misses.clear()
+        _command_misses.update(dict(keep))
+
+async def _answer_unknown_command(message, index, prefix, command):
+    if not command or len(command) > 40:
+        return  # a lone "!" or not a command at all
+    if not any(ch.isalnum() for ch in command):
+        return  # "!!!", "!?": punctuation, not a typo
+    if prefix == '@' and command in ('everyone', 'here'):
+        return
+    _count_command_miss(f"{prefix}{command}")
+    TRIGGER_MISSES.inc(prefix)
 
-    # 3) Check each one’s latest run
-    for owner, name in monitored:
-        runs_url = f"https://api.github.com/repos/{owner}/{name}/actions/runs?per_page=1"
-        r2 = requests.get(runs_url, headers=HEADERS)
-        if r2.status_code != 200:
-            continue
-        runs = r2.json().get("workflow_runs", [])
-        if not runs:
-            continue
+    if not SUGGEST_ENABLED:
+        return
+    # The same typo again in the channel gets no new reply while the trigger cooldown lasts
+    if TRIGGER_COOLDOWN_SECONDS > 0:
+        recent_replies = shard_state(message.guild).recent_replies
+        if _claim_trigger_reply(recent_replies, (message.channel.id, f"miss:{prefix}{command}")) is not None:
+            return
+    suggestions = index.suggesters[prefix].suggest(command)
+    if not suggestions:
+        return
+    options = " or ".join(f"`{prefix}{name}`" for name in suggestions)
+    try:
+        await message.reply(f"Did you mean {options}?", mention_author=False)
+    except discord.HTTPException as e:
+        print(f"Failed to suggest commands in channel {message.channel.id}: {e}")
 
-        latest = runs[0]
-        run_id = latest["id"]
-        created = datetime.fromisoformat(latest["created_at"].replace("Z", "+00:00"))
+async def _send_misses_report(channel, index):
+    if not _command_misses:
+        await channel.send("No unknown commands recorded yet.")
+        return
+    lines = []
+    for name, count in _command_misses.most_common(MISSES_REPORT_SIZE):
+        prefix, command = name[0], name[1:]
+        suggestions = index.suggesters[prefix].suggest(command, limit=1)
+        hint = f" → `{prefix}{suggestions[0]}`" if suggestions else ""
+        lines.append(f"`{name}` ×{count}{hint}")
+    embed = discord.Embed(
+        title="Unknown commands",
+        description="Most asked for recently (counts carry over restarts); candidates for new aliases.\n\n" + "\n".join(lines),
+        color=discord.Color.blue(),
+    )
+    await channel.send(embed=embed)
 
-        # ✅ Check if that run has any artifacts
-        artifacts_url = f"https://api.github.com/repos/{owner}/{name}/actions/runs/{run_id}/artifacts"
-        r3 = requests.get(artifacts_url, headers=HEADERS)
-        if r3.status_code != 200:
-            continue
-        artifact_data = r3.json()
-        if not artifact_data.get("artifacts"):  # skip repos with no artifacts
-            continue
+# --- Trigger usage ---
+# Hits per response and channel are counted in memory (one Counter increment per message)
+# and added to a SQLite file in batches, off the event loop. 0 turns usage tracking off.
+USAGE_FLUSH_SECONDS = config.get("usage_flush_seconds", 60)
+USAGE_DB_PATH = os.path.join(CACHE_FOLDER, "usage.sqlite3")
+USAGE_DEFAULT_TOP = 15
+USAGE_MAX_TOP = 50
+USAGE_DEFAULT_DAYS = 30
+USAGE_LANG_PREFIXES = {"en": "!", "esl": "¡", "ptbr": "@"}
+
+_usage_pending = Counter()  # (response key like "en:response28", channel_id) -> hits not written yet
+
+def _record_usage(response_key, channel_id):
+    if USAGE_FLUSH_SECONDS > 0:
+        _usage_pending[(response_key, channel_id)] += 1
+
+def _usage_connect():
+    db = sqlite3.connect(USAGE_DB_PATH, timeout=30)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS trigger_usage ("
+        " day TEXT NOT NULL, lang TEXT NOT NULL, response TEXT NOT NULL,"
+        " channel_id INTEGER NOT NULL, hits INTEGER NOT NULL,"
+        " PRIMARY KEY (day, lang, response, channel_id))"
+    )
+    return db
+
+def _write_usage(batch, day):
+    """Blocking: add a batch of hits to the day's rows in one transaction."""
+    rows = []
+    for (response_key, channel_id), hits in batch.items():
+        lang, response = response_key.split(":", 1)
+        rows.append((day, lang, response, channel_id, hits))
+    db = _usage_connect()
+    try:
+        with db:
+            db.executemany(
+                "INSERT INTO trigger_usage (day, lang, response, channel_id, hits) VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT (day, lang, response, channel_id) DO UPDATE SET hits = hits + excluded.hits",
+                rows,
+            )
+    finally:
+        db.close()
+
+def _take_usage_batch():
+    # Swap in a fresh counter; hits recorded while the batch is written go to the next one
+    global _usage_pending
+    batch, _usage_pending = _usage_pending, Counter()
+    return batch
+
+async def flush_usage():
+    batch = _take_usage_batch()
+    if not batch:
+        return
+    day = datetime.now(timezone.utc).date().isoformat()
+    try:
+        await asyncio.to_thread(_write_usage, batch, day)
+    except sqlite3.Error as e:
+        print(f"Failed to write trigger usage: {e}")
+        _usage_pending.update(batch)  # try again next time
+
+@tasks.loop(seconds=max(USAGE_FLUSH_SECONDS, 1))
+async def flush_usage_loop():
+    await flush_usage()
+
+def _read_usage(days, top):
+    """Blocking: (top responses as (lang, response, hits), busiest channels as (channel_id, hits), total, used keys)."""
+    since = (datetime.now(timezone.utc).date() - timedelta(days=days - 1)).isoformat()
+    db = _usage_connect()
+    try:
+        responses = db.execute(
+            "SELECT lang, response, SUM(hits) AS total FROM trigger_usage WHERE day >= ?"
+            " GROUP BY lang, response ORDER BY total DESC", (since,)).fetchall()
+        channels = db.execute(
+            "SELECT channel_id, SUM(hits) AS total FROM trigger_usage WHERE day >= ?"
+            " GROUP BY channel_id ORDER BY total DESC LIMIT 5", (since,)).fetchall()
+    finally:
+        db.close()
+    total = sum(hits for _, _, hits in responses)
+    used = {f"{lang}:{response}" for lang, response, _ in responses}
+    return responses[:top], channels, total, used
+
+async def send_usage_report(message, index):
+    if USAGE_FLUSH_SECONDS <= 0:
+        await message.channel.send("Usage tracking is off (`usage_flush_seconds` is 0).")
+        return
+    args = _command_args(message)
+    try:
+        top = int(args[0]) if args else USAGE_DEFAULT_TOP
+        days = int(args[1]) if len(args) > 1 else USAGE_DEFAULT_DAYS
+    except ValueError:
+        await message.channel.send("Usage: `!usage [top] [days]`")
+        return
+    top = max(1, min(top, USAGE_MAX_TOP))
+    days = max(1, days)
 
-        if (datetime.now(timezone.utc) - created).days >= 89:
-            display = name if owner == "nsneverhax" else f"{owner}/{name}"
-            stale.append((display, created.date(), latest["html_url"]))
+    await flush_usage()
+    try:
+        responses, channels, total, used = await asyncio.to_thread(_read_usage, days, top)
+    except sqlite3.Error as e:
+        await message.channel.send(f"Couldn't read usage: {e}")
+        return
 
-    # 4) Build and send a pretty embed
-    channel = client.get_channel(1186453136731287642)
-    if not channel:
+    tables = {"en": index.triggers, "esl": index.triggers_esl, "ptbr": index.triggers_ptbr}
+    lines = []
+    for lang, response, hits in responses:
+        entry = tables.get(lang, {}).get(response)
+        name = f"`{USAGE_LANG_PREFIXES.get(lang, '!')}{entry['triggers'][0]}`" if entry and entry['triggers'] else "*(removed)*"
+        lines.append(f"{name} {lang}:{response} — {hits} ({hits / total:.1%})")
+
+    all_keys = {f"{lang}:{key}" for lang, responses_of_lang in tables.items() for key in responses_of_lang}
+    embed = discord.Embed(
+        title=f"Trigger usage, last {days} days",
+        description="\n".join(lines) or "No triggers used yet.",
+        color=discord.Color.blue(),
+    )
+    if channels:
+        embed.add_field(name="Busiest channels", value="\n".join(f"<#{cid}> — {hits}" for cid, hits in channels), inline=False)
+    embed.set_footer(text=f"{total} hits; {len(all_keys - used)} of {len(all_keys)} responses unused in this period")
+    await message.channel.send(embed=embed)
+
+async def run_builtin_command(message, name, index):
+    if name == 'actions':
+        await check_actions_staleness(full_report=True)  # manual trigger
         return
 
-    if stale:
-        embed = discord.Embed(
-            title="🛠️ Stale GitHub Actions",
-            description="Workflows with no runs in the last 89 days:",
-            color=discord.Color.orange()
-        )
-        lines = [
-            f"• **{repo}** — last run `{when}`: <{url}>"
-            for repo, when, url in stale
-        ]
-        embed.add_field(
-            name=f"{len(stale)} stale repos",
-            value="\n".join(lines),
-            inline=False
+    if name == 'ping':
+        before = datetime.utcnow()
+        msg = await message.channel.send("🏓 Pong?")
+        after = datetime.utcnow()
+
+        rtt_ms = (after - before).total_seconds() * 1000
+
+        await msg.edit(
+            content=f"🏓 **Pong!**\n"
+                    f"{_websocket_latency_text(message.guild)}\n"
+                    f"Round-trip latency: `{rtt_ms:.1f} ms`"
         )
-    else:
         return
 
-    await channel.send(embed=embed)
+    if name == 'list':
+        await send_trigger_list(message.channel, message.author.id, index)
+        return
+
+    if name == 'progress':
+        try:
+            info = await get_decomp_info()
+        except RuntimeError as e:
+            print(e)
+            await message.channel.send("Couldn't reach progress.decomp.club right now, try again in a bit.")
+            return
+        await message.channel.send(info)
+        return
+
+    if name == 'misses':
+        await _send_misses_report(message.channel, index)
+        return
 
-async def process_trigger(channel, command, triggers_map, esl_triggers_with_exclamation_map, ptbr_triggers_with_exclamation_map):
-    command_lower = command.lower()
+    if name == 'memory':
+        await message.channel.send(embed=memory_report_embed())
+        return
 
-    if command_lower in triggers_map:
-        response = triggers_map[command_lower]
-        await handle_response(channel, response)
+    if name == 'profile':
+        await run_profile(message)
         return
 
-    if command_lower in esl_triggers_with_exclamation_map:
-        response = esl_triggers_with_exclamation_map[command_lower]
-        await handle_response(channel, response)
+    if name == 'memsnap':
+        await run_memsnap(message)
         return
 
-    if command_lower in ptbr_triggers_with_exclamation_map:
-        response = ptbr_triggers_with_exclamation_map[command_lower]
-        await handle_response(channel, response)
+    if name == 'usage':
+        await send_usage_report(message, index)
         return
 
-    print(f"Command '!{command}' not found.")
+# --- Memory report ---
+def _read_proc_status_kb(field):
+    # Linux only; None elsewhere
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+def _cgroup_memory_limit():
+    # The container's limit (cgroup v2, then v1); None when there is none
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path, encoding="ascii") as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value.isdigit() and int(value) < 1 << 60:
+            return int(value)
+    return None
+
+def _mib(nbytes):
+    return f"{nbytes / (1024 * 1024):.1f} MiB"
+
+def memory_report_embed():
+    embed = discord.Embed(title="Memory", color=discord.Color.blue())
+
+    rss_kb = _read_proc_status_kb("VmRSS")
+    peak_kb = _read_proc_status_kb("VmHWM")
+    limit = _cgroup_memory_limit()
+    if rss_kb is not None:
+        process = f"RSS {_mib(rss_kb * 1024)}"
+        if peak_kb is not None:
+            process += f", peak {_mib(peak_kb * 1024)}"
+        if limit is not None:
+            process += f"\nContainer limit {_mib(limit)} ({rss_kb * 1024 / limit:.0%} used)"
+        embed.add_field(name="Process", value=process, inline=False)
+
+    guilds = client.guilds
+    embed.add_field(name="discord.py caches", value=(
+        f"Profile `{MEMORY_PROFILE}`: max_messages `{MAX_MESSAGES}`, member_cache `{MEMBER_CACHE}`\n"
+        f"{len(client.cached_messages)} messages, {sum(len(g.members) for g in guilds)} members, "
+        f"{len(client.users)} users\n"
+        f"{len(guilds)} guilds, {sum(len(g.channels) + len(g.threads) for g in guilds)} channels, "
+        f"{len(client.emojis)} emojis, {len(client.stickers)} stickers"
+    ), inline=False)
+
+    windows = sum(len(shard.spam.recent_user_messages) for shard in _shard_states.values())
+    records = sum(len(bucket) for shard in _shard_states.values() for bucket in shard.spam.recent_user_messages.values())
+    cooldowns = sum(len(shard.spam.last_spam_action) for shard in _shard_states.values())
+    waves = sum(len(table) for shard in _shard_states.values() for table in shard.waves.guilds.values())
+    window_evictions = sum(shard.spam.evictions for shard in _shard_states.values())
+    wave_evictions = sum(shard.waves.evictions for shard in _shard_states.values())
+    queued = sum(len(shard.enforcement.pending) for shard in _shard_states.values())
+    coalesced = sum(shard.enforcement.coalesced for shard in _shard_states.values())
+    blocked = sum(shard.enforcement.blocked for shard in _shard_states.values())
+    replies = sum(len(shard.recent_replies) for shard in _shard_states.values())
+    embed.add_field(name="Bot state", value=(
+        f"Watchdog: {windows} windows ({records} messages), {cooldowns} cooldowns, "
+        f"{waves} wave payloads\n"
+        f"Softban queue: {queued} waiting, {coalesced} merged into a waiting job, "
+        f"{blocked} waited for room (max {ENFORCEMENT_QUEUE_SIZE} per shard)\n"
+        f"Evicted at the caps: {window_evictions} windows (max {SPAM_MAX_TRACKED_USERS}), "
+        f"{wave_evictions} wave payloads (max {SPAM_WAVE_MAX_PAYLOADS} per server)\n"
+        f"Trigger cooldowns: {replies}, unknown commands: {len(_command_misses)}\n"
+        f"Media URLs: {len(_media_url_cache)}, attachment checks: {len(_content_checks)}, "
+        f"GitHub responses: {len(github_cache.entries)}"
+    ), inline=False)
+    return embed
+
+# --- Profiling ---
+# !profile [seconds] samples the event loop thread's stack; !memsnap diffs tracemalloc
+# snapshots. Reports go to SPAM_REPORT_CHANNEL_ID as a file, or TEMP_FOLDER if that fails.
+PROFILE_DEFAULT_SECONDS = 10
+PROFILE_MAX_SECONDS = 60
+PROFILE_INTERVAL_SECONDS = 0.005
+PROFILE_TOP_FUNCTIONS = 30
+MEMSNAP_TRACE_FRAMES = 1   # more frames give tracebacks but make every allocation slower
+MEMSNAP_TRACE_MAX_SECONDS = 30 * 60  # tracing is stopped if no second !memsnap comes
+MEMSNAP_TOP_LINES = 30
+DEEP_SIZEOF_MAX_OBJECTS = 2_000_000
+
+_profile_running = False
+_memsnap_running = False
+_previous_memsnap = None
+_memsnap_timeout = None  # asyncio.TimerHandle that stops tracing
+
+def _command_args(message):
+    match = COMMAND_RE.search(message.content)
+    return message.content[match.end():].split() if match else []
+
+def _frame_label(code):
+    # "handle_response (nhxinfobot.py:1712)", with the def line so samples of one function add up
+    path = code.co_filename.replace("\\", "/").split("/")
+    return f"{code.co_name} ({'/'.join(path[-2:]) if len(path) > 1 else path[0]}:{code.co_firstlineno})"
+
+def _sample_stacks(thread_id, seconds, interval):
+    """Runs in a worker thread: sample thread_id's stack until the time is up."""
+    stacks = Counter()
+    samples = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        stack = []
+        while frame is not None:
+            stack.append(_frame_label(frame.f_code))
+            frame = frame.f_back
+        frame = None
+        if stack:
+            stacks[tuple(reversed(stack))] += 1
+            samples += 1
+        time.sleep(interval)
+    return stacks, samples
+
+def _profile_report(stacks, samples, seconds):
+    own = Counter()
+    inclusive = Counter()
+    idle = 0
+    for stack, count in stacks.items():
+        own[stack[-1]] += count
+        for label in set(stack):
+            inclusive[label] += count
+        # The loop waiting in select() for I/O means nothing was running
+        if stack[-1].startswith("select ("):
+            idle += count
+
+    pct = lambda count: f"{count / samples * 100:5.1f}%"
+    lines = [
+        f"Event loop profile: {seconds}s, {samples} samples every {PROFILE_INTERVAL_SECONDS * 1000:.0f} ms",
+        f"Idle (waiting for I/O): {pct(idle)}",
+        "",
+        f"Top {PROFILE_TOP_FUNCTIONS} functions by own time:",
+        *(f"  {pct(count)}  {label}" for label, count in own.most_common(PROFILE_TOP_FUNCTIONS)),
+        "",
+        f"Top {PROFILE_TOP_FUNCTIONS} functions including callees:",
+        *(f"  {pct(count)}  {label}" for label, count in inclusive.most_common(PROFILE_TOP_FUNCTIONS)),
+        "",
+        "Folded stacks (flamegraph.pl / speedscope input):",
+        *(f"{';'.join(stack)} {count}" for stack, count in stacks.most_common()),
+    ]
+    return "\n".join(lines) + "\n"
+
+def _deep_sizeof(root):
+    """
+    Bytes reachable from root, each object counted once. Discord models (anything with a
+    _state) and asyncio objects are counted shallowly: they belong to the client, not to us.
+    """
+    seen = set()
+    size = 0
+    stack = [root]
+    while stack and len(seen) < DEEP_SIZEOF_MAX_OBJECTS:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, (str, bytes, int, float, bool, type(None), type)) or callable(obj):
+            continue
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+            stack.extend(obj)
+        elif hasattr(obj, "_state") or type(obj).__module__.startswith("asyncio"):
+            continue
+        else:
+            for slot in getattr(type(obj), "__slots__", ()):
+                if hasattr(obj, slot):
+                    stack.append(getattr(obj, slot))
+            if hasattr(obj, "__dict__"):
+                stack.append(obj.__dict__)
+    return size
+
+def _memory_structures():
+    shards = list(_shard_states.values())
+    return [
+        ("ShardState.spam.recent_user_messages (watchdog windows)", [s.spam.recent_user_messages for s in shards]),
+        ("ShardState.spam.last_spam_action (spam cooldowns)", [s.spam.last_spam_action for s in shards]),
+        ("ShardState.waves (cross-account waves)", [s.waves.guilds for s in shards]),
+        ("ShardState.enforcement.pending (queued softbans)", [s.enforcement.pending for s in shards]),
+        ("ShardState.recent_replies (trigger cooldowns)", [s.recent_replies for s in shards]),
+        ("trigger_index (all trigger tables)", trigger_index),
+        ("trigger_index.list_pages (!list paginator pages)", trigger_index.list_pages),
+        ("trigger_index.suggesters (did you mean)", trigger_index.suggesters),
+        ("_media_url_cache", _media_url_cache),
+        ("_command_misses", _command_misses),
+        ("_fetched_channels", _fetched_channels),
+        ("github_cache.entries", github_cache.entries),
+        ("_usage_pending (trigger usage not yet in SQLite)", _usage_pending),
+    ]
+
+def _memsnap_structures():
+    """On the loop thread: the deep sizes walk dicts that handlers mutate."""
+    lines = ["Structures (deep size):"]
+    for name, obj in _memory_structures():
+        lines.append(f"  {_deep_sizeof(obj) / 1024:10.1f} KiB  {name}")
+    lines.append(f"  discord.py caches: {len(client.cached_messages)} messages, {len(client.users)} users, "
+                 f"{sum(len(g.members) for g in client.guilds)} members")
+    return lines
+
+def _memsnap_trace():
+    """
+    Blocking. The first call starts tracing; the next one diffs against that snapshot and
+    stops tracing again, so allocations don't pay for it longer than needed.
+    """
+    global _previous_memsnap
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(MEMSNAP_TRACE_FRAMES)
+        _previous_memsnap = tracemalloc.take_snapshot()
+        return [f"tracemalloc started; run !memsnap again within {MEMSNAP_TRACE_MAX_SECONDS // 60} minutes "
+                "to see what grew, or !memsnap stop."]
+
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+    current, peak = tracemalloc.get_traced_memory()
+    previous = _previous_memsnap
+    _stop_tracing()
+
+    lines = [f"Traced: {current / 1024 / 1024:.1f} MiB now, {peak / 1024 / 1024:.1f} MiB peak", ""]
+    lines.append(f"Top {MEMSNAP_TOP_LINES} growth since the previous !memsnap:")
+    for stat in snapshot.compare_to(previous, "lineno")[:MEMSNAP_TOP_LINES]:
+        lines.append(f"  {stat}")
+    lines.append("")
+    lines.append(f"Top {MEMSNAP_TOP_LINES} allocations now:")
+    for stat in snapshot.statistics("lineno")[:MEMSNAP_TOP_LINES]:
+        lines.append(f"  {stat}")
+    lines.append("")
+    lines.append("tracemalloc stopped.")
+    return lines
+
+def _stop_tracing():
+    global _previous_memsnap
+    _previous_memsnap = None
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+def _memsnap_expired():
+    global _memsnap_timeout
+    _memsnap_timeout = None
+    if not _memsnap_running and tracemalloc.is_tracing():
+        _stop_tracing()
+        print("tracemalloc stopped: no second !memsnap")
+
+async def _post_diagnostics(message, kind, text):
+    """Attach text to the report channel; fall back to a file in TEMP_FOLDER."""
+    filename = f"{kind}-{datetime.now(timezone.utc):%Y%m%d-%H%M%S}-{generate_session_hash()}.txt"
+    report_ch = await _get_channel_safe(SPAM_REPORT_CHANNEL_ID)
+    if report_ch is not None:
+        try:
+            await report_ch.send(f"{kind} requested by {message.author} in <#{message.channel.id}>",
+                                 file=discord.File(io.BytesIO(text.encode("utf-8")), filename=filename))
+            if report_ch.id != message.channel.id:
+                await message.channel.send(f"Posted `{filename}` in <#{report_ch.id}>.")
+            return
+        except discord.HTTPException as e:
+            print(f"Failed to post {filename}: {e}")
+
+    path = os.path.join(TEMP_FOLDER, filename)
+    await asyncio.to_thread(_write_file_atomic, path, text.encode("utf-8"))
+    await message.channel.send(f"Wrote `{path}` on the bot's host.")
+
+async def run_profile(message):
+    global _profile_running
+    args = _command_args(message)
+    try:
+        seconds = int(args[0]) if args else PROFILE_DEFAULT_SECONDS
+    except ValueError:
+        seconds = PROFILE_DEFAULT_SECONDS
+    seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+
+    if _profile_running:
+        await message.channel.send("A profile is already running.")
+        return
+    _profile_running = True
+    try:
+        await message.channel.send(f"Profiling the event loop for {seconds}s...")
+        stacks, samples = await asyncio.to_thread(
+            _sample_stacks, threading.get_ident(), seconds, PROFILE_INTERVAL_SECONDS)
+    finally:
+        _profile_running = False
+    if not samples:
+        await message.channel.send("No samples taken.")
+        return
+    await _post_diagnostics(message, "profile", _profile_report(stacks, samples, seconds))
 
-async def process_esl_trigger(channel, command, triggers_esl_map):
-    command_lower = command.lower()
+async def run_memsnap(message):
+    global _memsnap_running, _memsnap_timeout
+    if _memsnap_running:
+        await message.channel.send("A memory snapshot is already being taken.")
+        return
 
-    if command_lower in triggers_esl_map:
-        response = triggers_esl_map[command_lower]
-        await handle_response(channel, response)
+    args = _command_args(message)
+    if args and args[0].lower() == "stop":
+        if _memsnap_timeout is not None:
+            _memsnap_timeout.cancel()
+            _memsnap_timeout = None
+        was_tracing = tracemalloc.is_tracing()
+        _stop_tracing()
+        await message.channel.send("tracemalloc stopped." if was_tracing else "tracemalloc isn't running.")
         return
 
-    print(f"Command '¡{command}' not found.")
+    _memsnap_running = True
+    try:
+        lines = _memsnap_structures()
+        # Snapshots and diffs of a large heap take seconds; keep them off the heartbeat
+        lines += [""] + await asyncio.to_thread(_memsnap_trace)
+    finally:
+        _memsnap_running = False
+
+    if _memsnap_timeout is not None:
+        _memsnap_timeout.cancel()
+        _memsnap_timeout = None
+    if tracemalloc.is_tracing():
+        _memsnap_timeout = asyncio.get_running_loop().call_later(MEMSNAP_TRACE_MAX_SECONDS, _memsnap_expired)
+    await _post_diagnostics(message, "memsnap", "\n".join(lines) + "\n")
+
+# --- GitHub Actions staleness ---
+ACTIONS_REPORT_CHANNEL_ID = 1186453136731287642
+ACTIONS_STALE_DAYS = 89
+ACTIONS_STATE_PATH = os.path.join(CACHE_FOLDER, "actions_state.json")
+
+# Fetch the latest default-branch workflow run of many repos per GraphQL request.
+# Only repos that look stale (or have no run on their head commit) are confirmed over REST.
+ACTIONS_USE_GRAPHQL = config.get("actions_graphql", False)
+ACTIONS_GRAPHQL_PAGE_SIZE = 50
+ACTIONS_GRAPHQL_EXTRA_BATCH = 25
+
+_GRAPHQL_REPO_FIELDS = """
+    name
+    owner { login }
+    defaultBranchRef { target { ... on Commit {
+      checkSuites(last: 20) { nodes { workflowRun { databaseId createdAt url } } }
+    } } }
+"""
+
+def _load_actions_state():
+    try:
+        with open(ACTIONS_STATE_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable actions state {ACTIONS_STATE_PATH}: {e}")
+        return {}
+
+def _save_actions_state(state):
+    _write_file_atomic(ACTIONS_STATE_PATH, json.dumps(state, separators=(",", ":")).encode("utf-8"))
+
+def _extra_repos():
+    extras = []
+    for repo_full in EXTRA_REPOS:
+        if "/" in repo_full:
+            owner, name = repo_full.split("/", 1)
+        else:
+            owner, name = "nsneverhax", repo_full
+        extras.append((owner, name))
+    return extras
+
+async def _monitored_repos():
+    # 1) List all nsneverhax repos (every page)
+    repos = await github.get_all(f"{GITHUB_API_URL}/users/nsneverhax/repos?per_page=100")
 
-async def process_ptbr_trigger(channel, command, triggers_ptbr_map):
-    command_lower = command.lower()
+    # build a list of (owner, name), skipping ignored
+    monitored = [
+        ("nsneverhax", r["name"])
+        for r in repos
+        if r["name"] not in IGNORED_REPOS
+    ]
 
-    if command_lower in triggers_ptbr_map:
-        response = triggers_ptbr_map[command_lower]
-        await handle_response(channel, response)
+    # 2) Add any extras from config
+    for owner, name in _extra_repos():
+        if (owner, name) not in monitored:
+            monitored.append((owner, name))
+    return monitored
+
+def _graphql_latest_run(repo):
+    """Newest workflow run on the repo's default branch head, in the REST run shape, or None."""
+    target = ((repo.get("defaultBranchRef") or {}).get("target")) or {}
+    runs = [
+        suite["workflowRun"]
+        for suite in (target.get("checkSuites") or {}).get("nodes", [])
+        if suite and suite.get("workflowRun")
+    ]
+    if not runs:
+        return None
+    latest = max(runs, key=lambda run: run["createdAt"])
+    return {"id": latest["databaseId"], "created_at": latest["createdAt"], "html_url": latest["url"]}
+
+async def _graphql_latest_runs():
+    """Map (owner, name) -> latest default-branch run (or None) for every monitored repo."""
+    runs = {}
+
+    query = (
+        "query($login: String!, $cursor: String) { repositoryOwner(login: $login) {"
+        f" repositories(first: {ACTIONS_GRAPHQL_PAGE_SIZE}, after: $cursor, ownerAffiliations: OWNER) {{"
+        " pageInfo { hasNextPage endCursor }"
+        f" nodes {{ {_GRAPHQL_REPO_FIELDS} }} }} }} }}"
+    )
+    cursor = None
+    while True:
+        data = await github.graphql(query, {"login": "nsneverhax", "cursor": cursor})
+        repositories = data["repositoryOwner"]["repositories"]
+        for repo in repositories["nodes"]:
+            if repo["name"] not in IGNORED_REPOS:
+                runs[("nsneverhax", repo["name"])] = _graphql_latest_run(repo)
+        if not repositories["pageInfo"]["hasNextPage"]:
+            break
+        cursor = repositories["pageInfo"]["endCursor"]
+
+    # Extra repos by alias, a batch per request
+    extras = [key for key in _extra_repos() if key not in runs]
+    for i in range(0, len(extras), ACTIONS_GRAPHQL_EXTRA_BATCH):
+        batch = extras[i:i + ACTIONS_GRAPHQL_EXTRA_BATCH]
+        params = ", ".join(f"$o{j}: String!, $n{j}: String!" for j in range(len(batch)))
+        fields = " ".join(
+            f"r{j}: repository(owner: $o{j}, name: $n{j}) {{ {_GRAPHQL_REPO_FIELDS} }}" for j in range(len(batch)))
+        variables = {}
+        for j, (owner, name) in enumerate(batch):
+            variables[f"o{j}"] = owner
+            variables[f"n{j}"] = name
+        data = await github.graphql(f"query({params}) {{ {fields} }}", variables)
+        for j, key in enumerate(batch):
+            repo = data.get(f"r{j}")
+            if repo is not None:
+                runs[key] = _graphql_latest_run(repo)
+    return runs
+
+async def _latest_run_rest(owner, name):
+    runs_url = f"{GITHUB_API_URL}/repos/{owner}/{name}/actions/runs?per_page=1"
+    status, data, _ = await github.get(runs_url)
+    if status != 200:
+        return None
+    runs = data.get("workflow_runs", [])
+    return runs[0] if runs else None
+
+def _run_is_stale(run):
+    created = datetime.fromisoformat(run["created_at"].replace("Z", "+00:00"))
+    return (datetime.now(timezone.utc) - created).days >= ACTIONS_STALE_DAYS
+
+async def _check_repo(owner, name, hint, previous):
+    """
+    Return the repo's new state entry, or None if it can't be determined this run
+    (no runs, API error). hint is the GraphQL run, None means ask REST.
+    """
+    try:
+        run = hint
+        if run is None or _run_is_stale(run):
+            # REST sees runs on every branch; a conditional request, so usually free
+            run = await _latest_run_rest(owner, name)
+        if run is None:
+            return None
+
+        has_artifacts = None
+        if previous and previous.get("run_id") == run["id"]:
+            has_artifacts = previous.get("has_artifacts")
+
+        stale = _run_is_stale(run)
+        if stale and has_artifacts is None:
+            # ✅ Check if that run has any artifacts
+            artifacts_url = f"{GITHUB_API_URL}/repos/{owner}/{name}/actions/runs/{run['id']}/artifacts"
+            status, artifact_data, _ = await github.get(artifacts_url)
+            if status != 200:
+                return None
+            has_artifacts = bool(artifact_data.get("artifacts"))
+    except (GitHubError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"Failed to check actions for {owner}/{name}: {e!r}")
+        return None
+
+    return {
+        # repos with no artifacts are never reported
+        "stale": stale and bool(has_artifacts),
+        "run_id": run["id"],
+        "created_at": run["created_at"],
+        "url": run["html_url"],
+        "has_artifacts": has_artifacts,
+    }
+
+def _actions_report_line(repo, entry):
+    owner, name = repo.split("/", 1)
+    display = name if owner == "nsneverhax" else repo
+    when = datetime.fromisoformat(entry["created_at"].replace("Z", "+00:00")).date()
+    return f"• **{display}** — last run `{when}`: <{entry['url']}>"
+
+def _report_messages(title, description, color, sections):
+    """
+    Lay out [(field name, lines)] over as many fields, embeds and messages as Discord's
+    limits need (1024 per field, 25 fields and 6000 characters per embed and per message).
+    Returns a list of embed lists, one per message.
+    """
+    fields = []
+    for name, lines in sections:
+        value = ""
+        for line in lines:
+            line = line[:1024]
+            if value and len(value) + 1 + len(line) > 1024:
+                fields.append((name, value))
+                name = f"{name} (cont.)" if not name.endswith("(cont.)") else name
+                value = line
+            else:
+                value = f"{value}\n{line}" if value else line
+        if value:
+            fields.append((name, value))
+
+    header = len(title) + len(description)
+    embeds = []
+    embed, size = None, 0
+    for name, value in fields:
+        if embed is None or len(embed.fields) >= 25 or size + len(name) + len(value) > EMBED_TOTAL_LIMIT:
+            embed = discord.Embed(title=title, description=description if not embeds else None, color=color)
+            embeds.append(embed)
+            size = header
+        embed.add_field(name=name, value=value, inline=False)
+        size += len(name) + len(value)
+
+    messages = []
+    batch, batch_size = [], 0
+    for embed in embeds:
+        embed_size = len(embed)
+        if batch and (len(batch) >= 10 or batch_size + embed_size > EMBED_TOTAL_LIMIT):
+            messages.append(batch)
+            batch, batch_size = [], 0
+        batch.append(embed)
+        batch_size += embed_size
+    if batch:
+        messages.append(batch)
+    return messages
+
+@tasks.loop(hours=24)
+@_timed(ACTIONS_CHECK_SECONDS)
+async def check_actions_staleness(full_report=False):
+    """
+    Checks all repos under nsneverhax (minus IGNORED_REPOS) + any EXTRA_REPOS
+    for their most recent GitHub Actions run. If the latest run is 89 days or older,
+    reports it to the designated channel.
+
+    State is kept per repo between runs, so the daily run only reports repos that
+    became stale or recovered; full_report (the !actions command) lists every stale repo.
+    """
+    previous_state = await asyncio.to_thread(_load_actions_state)
+
+    hints = None
+    if ACTIONS_USE_GRAPHQL:
+        try:
+            hints = await _graphql_latest_runs()
+        except (GitHubError, aiohttp.ClientError, asyncio.TimeoutError, KeyError, TypeError) as e:
+            # KeyError/TypeError: an unexpected response shape, e.g. repositoryOwner null
+            print(f"GitHub GraphQL failed, checking repos over REST: {e!r}")
+
+    # A failure here skips this run; raising would stop the daily loop for good
+    try:
+        if hints is None:
+            hints = {key: None for key in await _monitored_repos()}
+    except (GitHubError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"Skipping the GitHub Actions check, couldn't list repos: {e!r}")
         return
 
-    print(f"Command '@{command}' not found.")
+    # Check each one’s latest run, concurrently (GitHubClient bounds the requests in flight)
+    repos = [f"{owner}/{name}" for owner, name in hints]
+    results = await asyncio.gather(*(
+        _check_repo(owner, name, hint, previous_state.get(f"{owner}/{name}"))
+        for (owner, name), hint in hints.items()
+    ))
+
+    state = {}
+    for repo, entry in zip(repos, results):
+        # Keep what we knew if the repo couldn't be checked this time
+        if entry is None:
+            entry = previous_state.get(repo)
+        if entry is not None:
+            state[repo] = entry
 
-async def send_trigger_list(channel, user_id):
-    # Collect English triggers and aliases
-    english_triggers = []
-    english_aliases_dict = {}
-    for value in triggers.values():
-        if value['triggers']:
-            original_trigger = value['triggers'][0]
-            english_triggers.append(original_trigger)
-            if len(value['triggers']) > 1:
-                english_aliases_dict[original_trigger] = value['triggers'][1:]
+    try:
+        await asyncio.to_thread(_save_actions_state, state)
+    except OSError as e:
+        print(f"Failed to save GitHub Actions state: {e}")
 
-    # Collect Spanish triggers and aliases
-    spanish_triggers = []
-    spanish_aliases_dict = {}
-    for value in triggers_esl.values():
-        if value['triggers']:
-            original_trigger = value['triggers'][0]
-            spanish_triggers.append(original_trigger)
-            if len(value['triggers']) > 1:
-                spanish_aliases_dict[original_trigger] = value['triggers'][1:]
+    entries = github_cache.checkpoint()
+    if entries is not None:
+        try:
+            await asyncio.to_thread(github_cache.save, entries)
+        except OSError as e:
+            github_cache.dirty = True  # try again next run
+            print(f"Failed to save the GitHub cache: {e}")
+
+    stale = [repo for repo, entry in state.items() if entry["stale"]]
+    newly_stale = [repo for repo in stale if not previous_state.get(repo, {}).get("stale")]
+    recovered = [repo for repo, entry in previous_state.items()
+                 if entry.get("stale") and repo in state and not state[repo]["stale"]]
+
+    # Build and send pretty embeds
+    channel = client.get_channel(ACTIONS_REPORT_CHANNEL_ID)
+    if not channel:
+        return
 
-    # Remove duplicates and sort triggers
-    english_triggers = sorted(set(english_triggers))
-    spanish_triggers = sorted(set(spanish_triggers))
-    english_aliases_dict = {key: sorted(english_aliases_dict[key]) for key in sorted(english_aliases_dict)}
-    spanish_aliases_dict = {key: sorted(spanish_aliases_dict[key]) for key in sorted(spanish_aliases_dict)}
+    if full_report:
+        if not stale:
+            return
+        sections = [(f"{len(stale)} stale repos", [_actions_report_line(repo, state[repo]) for repo in stale])]
+        description = f"Workflows with no runs in the last {ACTIONS_STALE_DAYS} days:"
+    else:
+        if not newly_stale and not recovered:
+            return
+        sections = [
+            (f"{len(newly_stale)} newly stale repos", [_actions_report_line(repo, state[repo]) for repo in newly_stale]),
+            (f"{len(recovered)} recovered repos", [_actions_report_line(repo, state[repo]) for repo in recovered]),
+        ]
+        description = f"Changes since the last check ({len(stale)} stale in total, no runs in the last {ACTIONS_STALE_DAYS} days):"
 
-    # Combine English and Spanish triggers
-    unique_triggers = english_triggers + spanish_triggers
-    alias_triggers_dict = {**english_aliases_dict, **spanish_aliases_dict}
+    for embeds in _report_messages("🛠️ Stale GitHub Actions", description, discord.Color.orange(), sections):
+        await channel.send(embeds=embeds)
 
-    # Create pagination view
-    view = PaginatorView(unique_triggers, alias_triggers_dict, user_id=user_id)
-    embed = view.get_embed()
-    view.message = await channel.send(embed=embed, view=view)
+async def send_trigger_list(channel, user_id, index):
+    pages = index.list_pages[False]
+    await channel.send(embed=pages[0], view=list_page_view(pages, False, 0, user_id))
 
 
-async def handle_response(channel, response):
-    if text := response.get("text"):
-        await send_long_message(channel, text)
+# --- Media cache ---
+# Files are uploaded once; later hits link the CDN copy instead of re-reading and re-uploading them.
+MAX_FILES_PER_MESSAGE = 10                  # Discord's attachment limit per message
+DEFAULT_UPLOAD_LIMIT = 10 * 1024 * 1024     # used outside guilds (DMs)
+MEDIA_CACHE_TTL_SECONDS = 20 * 60 * 60      # attachment URLs are signed and expire after ~24h
+MEDIA_CACHE_EXPIRY_MARGIN_SECONDS = 60 * 60
+
+_media_url_cache = {}  # file path -> (url, expires_at, mtime_ns)
 
+def _attachment_url_expiry(url: str) -> float:
+    # Signed CDN URLs carry their expiry as a hex unix timestamp in the "ex" parameter
+    expires_at = time.time() + MEDIA_CACHE_TTL_SECONDS
+    ex = parse_qs(urlsplit(url).query).get("ex")
+    if ex:
+        try:
+            expires_at = min(expires_at, int(ex[0], 16) - MEDIA_CACHE_EXPIRY_MARGIN_SECONDS)
+        except ValueError:
+            pass
+    return expires_at
+
+def _cached_media_url(path: str, mtime_ns: int):
+    entry = _media_url_cache.get(path)
+    if entry is None:
+        return None
+    url, expires_at, cached_mtime_ns = entry
+    if cached_mtime_ns != mtime_ns or expires_at <= time.time():
+        # The file changed on disk or the signed URL is about to expire
+        del _media_url_cache[path]
+        return None
+    return url
+
+def _remember_media_url(path: str, mtime_ns: int, url: str):
+    _media_url_cache[path] = (url, _attachment_url_expiry(url), mtime_ns)
+
+def _upload_batches(uploads, size_limit):
+    # Group (path, size, mtime_ns) uploads by Discord's file count and upload size limits
+    batch = []
+    batch_size = 0
+    for upload in uploads:
+        size = upload[1]
+        if batch and (len(batch) >= MAX_FILES_PER_MESSAGE or batch_size + size > size_limit):
+            yield batch
+            batch = []
+            batch_size = 0
+        batch.append(upload)
+        batch_size += size
+    if batch:
+        yield batch
+
+def _prepare_files(channel, files):
+    """
+    Split a response's files into notices for missing files, links to cached uploads
+    and batches of files that still have to be uploaded.
+    """
     base_dir = os.path.dirname(os.path.abspath(__file__))
-    for file in response.get("files", []):
+
+    notes = []
+    uploads = []
+    for file in files:
         file_path = os.path.join(base_dir, file)
-        if os.path.exists(file_path):
-            await channel.send(file=discord.File(file_path))
-        else:
-            await channel.send(f"Sorry, I couldn't find the file: {file}")
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            notes.append(f"Sorry, I couldn't find the file: {file}")
+            continue
 
-async def send_long_message(channel, text):
-    while len(text) > 2000:
-        split_index = text.rfind('\n', 0, 2000)
+        url = _cached_media_url(file_path, st.st_mtime_ns)
+        if url:
+            # Discord embeds these links like attachments
+            name = os.path.basename(file).replace("[", "\\[").replace("]", "\\]")
+            notes.append(f"-# [{name}]({url})")
+        else:
+            uploads.append((file_path, st.st_size, st.st_mtime_ns))
+
+    guild = getattr(channel, "guild", None)
+    size_limit = guild.filesize_limit if guild else DEFAULT_UPLOAD_LIMIT
+    return notes, list(_upload_batches(uploads, size_limit))
+
+# --- Response packing ---
+MESSAGE_CONTENT_LIMIT = 2000
+EMBED_DESCRIPTION_LIMIT = 4096
+EMBED_TOTAL_LIMIT = 6000         # summed over every embed in one message
+
+def _split_text(text, limit):
+    # Split at the last newline before the limit, hard split if a line is too long
+    chunks = []
+    while len(text) > limit:
+        split_index = text.rfind('\n', 0, limit)
         if split_index == -1:
-            split_index = 2000
-        await channel.send(text[:split_index])
+            split_index = limit
+        chunks.append(text[:split_index])
         text = text[split_index:].lstrip('\n')
 
     if text:
-        await channel.send(text)
+        chunks.append(text)
+    return chunks
 
-def _now_utc():
-    return datetime.now(timezone.utc)
+def pack_text(text, fmt=None):
+    """
+    Turn response text into as few channel.send() keyword sets as possible.
+    Text that fits in one message stays plain (link previews keep working);
+    longer text goes into embed descriptions, several embeds per message.
+    A response can force either with "format": "plain" / "embed".
+    """
+    if not text:
+        return []
+
+    if fmt is None:
+        fmt = "plain" if len(text) <= MESSAGE_CONTENT_LIMIT else "embed"
+
+    if fmt == "plain":
+        return [{"content": chunk} for chunk in _split_text(text, MESSAGE_CONTENT_LIMIT)]
+
+    # Fill each message up to the per-message embed budget, then cut that into descriptions
+    messages = []
+    for message_text in _split_text(text, EMBED_TOTAL_LIMIT):
+        embeds = [
+            discord.Embed(description=chunk, color=discord.Color.blue())
+            for chunk in _split_text(message_text, EMBED_DESCRIPTION_LIMIT)
+        ]
+        messages.append({"embeds": embeds})
+    return messages
+
+def _append_content(message, extra):
+    # Add a line to a packed message if it still fits, so it doesn't need its own send
+    content = message.get("content")
+    combined = f"{content}\n{extra}" if content else extra
+    if len(combined) > MESSAGE_CONTENT_LIMIT:
+        return False
+    message["content"] = combined
+    return True
+
+@_timed(HANDLE_RESPONSE_SECONDS)
+async def handle_response(channel, response):
+    """Send a trigger response and return the first message sent (None if there was nothing to send)."""
+    messages = pack_text(response.get("text"), response.get("format"))
+    notes, batches = _prepare_files(channel, response.get("files", []))
+
+    for note in notes:
+        if not messages or not _append_content(messages[-1], note):
+            messages.append({"content": note})
+
+    # The first batch of uploads rides along with the last text message
+    for batch in batches:
+        if messages and "files" not in messages[-1]:
+            messages[-1]["files"] = batch
+        else:
+            messages.append({"files": batch})
+
+    first = None
+    for kwargs in messages:
+        batch = kwargs.get("files")
+        if batch:
+            kwargs = {**kwargs, "files": [discord.File(path) for path, _, _ in batch]}
+        msg = await channel.send(**kwargs)
+        if first is None:
+            first = msg
+        if batch:
+            for (path, _, mtime_ns), attachment in zip(batch, msg.attachments):
+                _remember_media_url(path, mtime_ns, attachment.url)
+
+    return first
+
+# --- Trigger cooldown ---
+# The same response in the same channel is only sent once per window (0 disables this).
+TRIGGER_COOLDOWN_SECONDS = config.get("trigger_cooldown_seconds", 10)
+# What a repeat inside the window gets: "react" on the request, "reply" with a link to the earlier answer, or "skip"
+TRIGGER_COOLDOWN_MODES = ("react", "reply", "skip")
+TRIGGER_COOLDOWN_MODE = config.get("trigger_cooldown_mode", "react")
+if TRIGGER_COOLDOWN_MODE not in TRIGGER_COOLDOWN_MODES:
+    raise ValueError(f"config: trigger_cooldown_mode must be one of {', '.join(TRIGGER_COOLDOWN_MODES)}")
+TRIGGER_COOLDOWN_EMOJI = "👆"
+TRIGGER_COOLDOWN_MAX_ENTRIES = 4096
+
+def _claim_trigger_reply(recent_replies, key):
+    """
+    Return the recent entry if this response was already sent to the channel within the window,
+    otherwise claim the slot and return None. recent_replies is the shard's ShardState.recent_replies.
+    """
+    now = time.monotonic()
+    while recent_replies:
+        oldest_ts = next(iter(recent_replies.values()))[0]
+        if now - oldest_ts < TRIGGER_COOLDOWN_SECONDS and len(recent_replies) < TRIGGER_COOLDOWN_MAX_ENTRIES:
+            break
+        recent_replies.popitem(last=False)
+
+    entry = recent_replies.get(key)
+    if entry is not None:
+        return entry
+
+    recent_replies[key] = [now, None]
+    return None
+
+async def _answer_repeat_trigger(message, entry):
+    jump_url = entry[1]
+    try:
+        if TRIGGER_COOLDOWN_MODE == "reply" and jump_url:
+            await message.reply(f"Answered just above: {jump_url}", mention_author=False)
+        elif TRIGGER_COOLDOWN_MODE in ("react", "reply"):
+            await message.add_reaction(TRIGGER_COOLDOWN_EMOJI)
+    except discord.HTTPException as e:
+        print(f"Failed to answer repeated trigger in channel {message.channel.id}: {e}")
 
 def _normalize_text(s: str) -> str:
     s = (s or "").strip().lower()
     s = " ".join(s.split())
     return s
 
-def _attachment_sig(att: discord.Attachment) -> str:
-    # No file hashing needed; metadata is enough for “same image pasted everywhere”
-    # (filename/size/content_type are stable in typical spam)
+# Attachments are signed by their metadata while the message is handled. Only when a user's
+# window would be actioned except that no payload repeats (a renamed copy of the same image)
+# are the attachments hashed by their first bytes, in the background. Downloads are capped
+# per guild; over budget (or on a failed download) the metadata signature stays.
+ATTACHMENT_HASH_BYTES = 64 * 1024
+ATTACHMENT_HASH_TIMEOUT_SECONDS = 3
+ATTACHMENT_HASH_BUDGET_BYTES = 16 * 1024 * 1024   # downloaded per guild ...
+ATTACHMENT_HASH_BUDGET_SECONDS = 60               # ... per this many seconds
+
+_attachment_budget = {}  # guild_id -> [window start (ms), bytes used]
+_content_checks = {}     # (guild_id, user_id) -> background hashing task
+
+def _attachment_meta_sig(att: discord.Attachment) -> str:
     return f"{att.filename}|{att.size}|{att.content_type or ''}"
 
+def _take_attachment_budget(guild_id, nbytes, now) -> bool:
+    window = _attachment_budget.get(guild_id)
+    if window is None or now - window[0] >= ATTACHMENT_HASH_BUDGET_SECONDS * 1000:
+        window = _attachment_budget[guild_id] = [now, 0]
+    if window[1] + nbytes > ATTACHMENT_HASH_BUDGET_BYTES:
+        return False
+    window[1] += nbytes
+    return True
+
+async def _hash_attachment_prefix(url: str):
+    """blake2b of the first ATTACHMENT_HASH_BYTES of url, or None if it can't be downloaded in time."""
+    digest = hashlib.blake2b(digest_size=16)
+    remaining = ATTACHMENT_HASH_BYTES
+    try:
+        async with _get_http_session().get(
+            url,
+            headers={"Range": f"bytes=0-{ATTACHMENT_HASH_BYTES - 1}"},
+            timeout=aiohttp.ClientTimeout(total=ATTACHMENT_HASH_TIMEOUT_SECONDS),
+        ) as resp:
+            if resp.status not in (200, 206):
+                return None
+            # servers that ignore Range send the whole file; stop reading after the prefix
+            async for chunk in resp.content.iter_chunked(16 * 1024):
+                digest.update(chunk[:remaining])
+                remaining -= len(chunk)
+                if remaining <= 0:
+                    break
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        return None
+    return digest.hexdigest()
+
+async def _attachment_content_sig(url, size, meta_sig, guild_id) -> str:
+    if not _take_attachment_budget(guild_id, min(size, ATTACHMENT_HASH_BYTES), _monotonic_ms()):
+        return meta_sig
+    digest = await _hash_attachment_prefix(url)
+    if digest is None:
+        return meta_sig
+    # size too: the hash only covers the start of the file
+    return f"h:{digest}|{size}"
+
+async def _hash_record_attachments(record: SpamRecord, guild_id):
+    """Swap the record's attachment metadata signatures for content hashes."""
+    attachments, record.attachments = record.attachments, None
+    sigs = await asyncio.gather(*(_attachment_content_sig(url, size, meta, guild_id) for url, size, meta in attachments))
+    old = "att:" + ",".join(meta for _, _, meta in attachments)
+    record.payload_sig = record.payload_sig.replace(old, "att:" + ",".join(sigs), 1)
+
+def _start_content_check(guild, author, key):
+    if key not in _content_checks:
+        _content_checks[key] = asyncio.create_task(_check_content_duplicates(guild, author, key))
+
+async def _check_content_duplicates(guild, author, key):
+    """Background: hash the window's attachments and action the user if copies now match."""
+    try:
+        state = shard_state(guild).spam
+        bucket = state.recent_user_messages.get(key)
+        if not bucket:
+            return
+        await asyncio.gather(*(_hash_record_attachments(e, guild.id) for e in list(bucket) if e.attachments))
+
+        now = _monotonic_ms()
+        if key not in state.recent_user_messages or state.cooling_down(key, now):
+            return  # actioned meanwhile
+        bucket = state.window(key, now)
+        reason = _spam_window_reason(bucket)
+        if reason is None:
+            return
+        state.mark_action(key, now)
+        evidence = list(bucket)
+        state.drop(key)
+        await _enqueue_enforcement(guild, author, evidence, reason)
+    finally:
+        _content_checks.pop(key, None)
+
 def _message_payload_signature(message: discord.Message) -> str:
     """
     One string representing what was posted:
@@ -629,7 +2518,7 @@ def _message_payload_signature(message: discord.Message) -> str:
         parts.append(f"txt:{txt}")
 
     if message.attachments:
-        atts = ",".join(_attachment_sig(a) for a in message.attachments)
+        atts = ",".join(_attachment_meta_sig(a) for a in message.attachments)
         parts.append(f"att:{atts}")
 
     # sometimes spam comes as embeds (link previews)
@@ -652,53 +2541,98 @@ async def _get_channel_safe(channel_id: int):
     except Exception:
         return None
 
-async def _delete_message_by_id(guild: discord.Guild, channel_id: int, message_id: int) -> bool:
-    ch = guild.get_channel(channel_id)
-    if ch is None:
-        try:
-            ch = await guild.fetch_channel(channel_id)
-        except Exception:
-            return False
+# Evidence deletion: channels are cleaned concurrently, messages deleted by ID without fetching them
+SPAM_DELETE_CONCURRENCY = 5     # channels cleaned at once (discord.py handles per-route rate limits)
+BULK_DELETE_MAX = 100           # Discord's bulk delete limit, messages must be < 14 days old
+_FETCHED_CHANNELS_MAX = 256
+
+_fetched_channels = OrderedDict()  # channel_id -> channel, for channels missing from the gateway cache
+_delete_semaphore = asyncio.Semaphore(SPAM_DELETE_CONCURRENCY)
+
+async def _resolve_channel(guild: discord.Guild, channel_id: int):
+    ch = guild.get_channel_or_thread(channel_id)
+    if ch is not None:
+        return ch
+
+    ch = _fetched_channels.get(channel_id)
+    if ch is not None:
+        _fetched_channels.move_to_end(channel_id)
+        return ch
+    try:
+        ch = await guild.fetch_channel(channel_id)
+    except Exception:
+        return None
+    _fetched_channels[channel_id] = ch
+    if len(_fetched_channels) > _FETCHED_CHANNELS_MAX:
+        _fetched_channels.popitem(last=False)
+    return ch
 
+async def _delete_one(ch, message_id: int) -> bool:
     try:
-        msg = await ch.fetch_message(message_id)
-        await msg.delete()
+        await ch.get_partial_message(message_id).delete()
         return True
     except discord.NotFound:
         return True  # already gone is fine
-    except discord.Forbidden:
-        return False
     except Exception:
         return False
 
-async def _ban_and_report_for_spam(message: discord.Message, evidence: list[dict], reason: str):
-    guild = message.guild
-    if not guild:
-        return
-
-    # 1) Delete evidence messages first (best-effort)
-    deleted = 0
-    failed_delete = 0
+async def _delete_in_channel(guild: discord.Guild, channel_id: int, message_ids: list[int]) -> int:
+    """Delete messages of one channel; returns how many are gone."""
+    async with _delete_semaphore:
+        ch = await _resolve_channel(guild, channel_id)
+        if ch is None or not hasattr(ch, "get_partial_message"):
+            return 0
+
+        deleted = 0
+        for i in range(0, len(message_ids), BULK_DELETE_MAX):
+            chunk = message_ids[i:i + BULK_DELETE_MAX]
+            if len(chunk) > 1 and hasattr(ch, "delete_messages"):
+                try:
+                    await ch.delete_messages([discord.Object(id=mid) for mid in chunk])
+                    deleted += len(chunk)
+                    continue
+                except discord.Forbidden:
+                    return deleted
+                except discord.HTTPException:
+                    pass  # e.g. some already deleted; fall back to one by one
+            for mid in chunk:
+                if await _delete_one(ch, mid):
+                    deleted += 1
+        return deleted
+
+async def _delete_evidence(guild: discord.Guild, evidence: list[SpamRecord]):
+    """Delete evidence messages grouped by channel, channels in parallel. Returns (deleted, failed)."""
+    by_channel = {}
     for e in evidence:
-        ok = await _delete_message_by_id(guild, e["channel_id"], e["message_id"])
-        if ok:
-            deleted += 1
-        else:
-            failed_delete += 1
+        ids = by_channel.setdefault(e.channel_id, [])
+        if e.message_id not in ids:
+            ids.append(e.message_id)
 
-    # 2) Softban: Ban (purge) then Unban (so it's effectively a kick + cleanup)
-    ban_error = None
-    unban_error = None
+    results = await asyncio.gather(*(
+        _delete_in_channel(guild, channel_id, ids) for channel_id, ids in by_channel.items()
+    ))
+    deleted = sum(results)
+    total = sum(len(ids) for ids in by_channel.values())
+    return deleted, total - deleted
 
-    try:
+async def _ban_and_report_for_spam(guild: discord.Guild, user: discord.abc.User, evidence: list[SpamRecord], reason: str):
+
+    # 1) Delete evidence messages (best-effort) while the ban goes out, nothing waits on the other
+    async def ban():
         try:
-            # discord.py newer
-            await guild.ban(message.author, reason=reason, delete_message_seconds=3600)
-        except TypeError:
-            # discord.py older
-            await guild.ban(message.author, reason=reason, delete_message_days=1)
-    except Exception as e:
-        ban_error = e
+            try:
+                # discord.py newer
+                await guild.ban(user, reason=reason, delete_message_seconds=3600)
+            except TypeError:
+                # discord.py older
+                await guild.ban(user, reason=reason, delete_message_days=1)
+        except Exception as e:
+            return e
+        return None
+
+    # 2) Softban: Ban (purge) then Unban (so it's effectively a kick + cleanup)
+    (deleted, failed_delete), ban_error = await asyncio.gather(_delete_evidence(guild, evidence), ban())
+    unban_error = None
 
     if ban_error is None:
         # Small delay helps avoid occasional race conditions between ban/unban
@@ -706,7 +2640,7 @@ async def _ban_and_report_for_spam(message: discord.Message, evidence: list[dict
 
         try:
             # Use an Object by ID so this works even if Member object is stale post-ban
-            await guild.unban(discord.Object(id=message.author.id), reason=f"Softban release: {reason}")
+            await guild.unban(discord.Object(id=user.id), reason=f"Softban release: {reason}")
         except Exception as e:
             unban_error = e
 
@@ -717,26 +2651,26 @@ async def _ban_and_report_for_spam(message: discord.Message, evidence: list[dict
 
     if ban_error is not None:
         embed = discord.Embed(title="Spam watchdog: softban failed (ban step)", color=discord.Color.red())
-        embed.add_field(name="User", value=f"{message.author} ({message.author.id})", inline=False)
+        embed.add_field(name="User", value=f"{user} ({user.id})", inline=False)
         embed.add_field(name="Reason", value=reason, inline=False)
         embed.add_field(name="Delete results", value=f"deleted={deleted}, failed={failed_delete}", inline=False)
         embed.add_field(name="Error", value=str(ban_error)[:1024], inline=False)
         await report_ch.send(embed=embed)
         return
 
-    chan_ids = [e["channel_id"] for e in evidence]
+    chan_ids = [e.channel_id for e in evidence]
     unique_channels = sorted(set(chan_ids))
     channel_mentions = ", ".join(f"<#{cid}>" for cid in unique_channels[:25]) or "None"
 
-    links = [e.get("jump_url") for e in evidence if e.get("jump_url")]
-    payloads = [e.get("payload_sig") for e in evidence if e.get("payload_sig")]
+    links = [f"https://discord.com/channels/{guild.id}/{e.channel_id}/{e.message_id}" for e in evidence]
+    payloads = [e.payload_sig for e in evidence if e.payload_sig]
     sample_payload = payloads[-1] if payloads else None
 
     title = "Spam watchdog: user softbanned"
     color = discord.Color.orange()
 
     embed = discord.Embed(title=title, color=color)
-    embed.add_field(name="User", value=f"{message.author} (<@{message.author.id}>)", inline=False)
+    embed.add_field(name="User", value=f"{user} (<@{user.id}>)", inline=False)
     embed.add_field(name="Reason", value=reason, inline=False)
     embed.add_field(name="Delete results", value=f"deleted={deleted}, failed={failed_delete}", inline=False)
     embed.add_field(name="Channels hit (window)", value=channel_mentions[:1024], inline=False)
@@ -758,7 +2692,90 @@ async def _ban_and_report_for_spam(message: discord.Message, evidence: list[dict
 
     await report_ch.send(embed=embed)
 
+# --- Enforcement queue ---
+# Detection runs inline in on_message; the softban sequence (deletes, ban, unban, report) takes
+# seconds, so it runs on a few workers instead and on_message goes straight on to triggers.
+ENFORCEMENT_WORKERS = 4
+ENFORCEMENT_QUEUE_SIZE = 256   # when full, only the message that detected spam waits for room
+
+class EnforcementQueue:
+    """
+    Bounded queue of softbans. Jobs for a user that is already waiting are merged into the
+    waiting job (one ban, all the evidence), so a burst from one spammer is one action.
+    """
+    def __init__(self, workers=ENFORCEMENT_WORKERS, maxsize=ENFORCEMENT_QUEUE_SIZE):
+        self.workers = workers
+        self.queue = asyncio.Queue(maxsize)
+        self.pending = {}   # (guild_id, user_id) -> [guild, user, evidence, reason], until a worker takes it
+        self.tasks = []
+        self.coalesced = 0  # jobs merged into a waiting one
+        self.blocked = 0    # put() calls that had to wait for room
+
+    def _start(self):
+        self.tasks = [t for t in self.tasks if not t.done()]
+        while len(self.tasks) < self.workers:
+            self.tasks.append(asyncio.create_task(self._worker()))
+
+    async def put(self, guild, user, evidence, reason):
+        key = (guild.id, user.id)
+        job = self.pending.get(key)
+        if job is not None:
+            seen = {e.message_id for e in job[2]}
+            job[2].extend(e for e in evidence if e.message_id not in seen)
+            self.coalesced += 1
+            ENFORCEMENT_JOBS.inc("coalesced")
+            return
 
+        self._start()
+        job = [guild, user, list(evidence), reason]
+        self.pending[key] = job
+        if self.queue.full():
+            self.blocked += 1
+            ENFORCEMENT_JOBS.inc("blocked")
+        try:
+            await self.queue.put(key)
+        except BaseException:
+            self.pending.pop(key, None)
+            raise
+
+    async def _worker(self):
+        while True:
+            key = await self.queue.get()
+            guild, user, evidence, reason = self.pending.pop(key)
+            try:
+                await _ban_and_report_for_spam(guild, user, evidence, reason)
+            except Exception as e:
+                print(f"Spam enforcement failed for {user} ({user.id}): {e!r}")
+            finally:
+                self.queue.task_done()
+
+class ShardState:
+    """Watchdog, enforcement and trigger cooldown state for the guilds of one shard."""
+    __slots__ = ("spam", "waves", "enforcement", "recent_replies")
+
+    def __init__(self):
+        self.spam = SpamWatchdogState()
+        self.waves = SpamWaveTracker()
+        self.enforcement = EnforcementQueue()
+        # (channel_id, response key) -> [monotonic ts, jump url of the reply or None while it is being sent]
+        # Kept in insertion order, which is also expiry order.
+        self.recent_replies = OrderedDict()
+
+_shard_states = {}  # shard_id -> ShardState
+
+def shard_state(guild) -> ShardState:
+    # DMs arrive on shard 0
+    shard_id = getattr(guild, "shard_id", 0) if guild else 0
+    state = _shard_states.get(shard_id)
+    if state is None:
+        state = _shard_states[shard_id] = ShardState()
+    return state
+
+async def _enqueue_enforcement(guild: discord.Guild, user: discord.abc.User, evidence: list[SpamRecord], reason: str):
+    SPAM_ACTIONS.inc()
+    await shard_state(guild).enforcement.put(guild, user, evidence, reason)
+
+@_timed(SPAM_WATCHDOG_SECONDS)
 async def spam_watchdog(message: discord.Message) -> bool:
     if not message.guild:
         return False
@@ -768,15 +2785,18 @@ async def spam_watchdog(message: discord.Message) -> bool:
         return False
 
     # avoid banning staff/mods
-    perms = message.author.guild_permissions
-    if perms.administrator or perms.manage_guild or perms.manage_messages or perms.ban_members or perms.kick_members:
+    if _is_staff(message.author):
         return False
 
-    now = _now_utc()
+    now = _monotonic_ms()
     key = (message.guild.id, message.author.id)
 
-    last = _last_spam_action.get(key)
-    if last and (now - last).total_seconds() < SPAM_ACTION_COOLDOWN_SECONDS:
+    shard = shard_state(message.guild)
+    state = shard.spam
+    state.sweep(now)
+    if state.swept_at == now:
+        shard.waves.sweep(now)
+    if state.cooling_down(key, now):
         return False
 
     payload_sig = _message_payload_signature(message)
@@ -792,68 +2812,158 @@ async def spam_watchdog(message: discord.Message) -> bool:
             if member:
                 score = _scam_pitch_score(message)
                 if score >= SCAM_PITCH_MIN_SCORE:
-                    _last_spam_action[key] = now
+                    state.mark_action(key, now)
 
-                    evidence = [{
-                        "ts": now,
-                        "channel_id": message.channel.id,
-                        "message_id": message.id,
-                        "jump_url": getattr(message, "jump_url", None),
-                        "payload_sig": payload_sig,
-                    }]
+                    evidence = [SpamRecord(now, message.channel.id, message.id, payload_sig)]
 
                     reason = f"Spam watchdog (softban): solicitation/scam pitch heuristic (score={score})"
-                    await _ban_and_report_for_spam(message, evidence, reason)
+                    await _enqueue_enforcement(message.guild, message.author, evidence, reason)
                     return True
 
-    bucket = _recent_user_messages[key]
-    bucket.append({
-        "ts": now,
-        "channel_id": message.channel.id,
-        "message_id": message.id,
-        "jump_url": getattr(message, "jump_url", None),
-        "payload_sig": payload_sig,
-    })
+    bucket = state.window(key, now)
+    # Same payload already in this user's window: they're repeating themselves, not a new account
+    repeat = any(e.payload_sig == payload_sig for e in bucket)
+    attachments = tuple((a.url, a.size, _attachment_meta_sig(a)) for a in message.attachments) or None
+    record = SpamRecord(now, message.channel.id, message.id, payload_sig, attachments)
+    bucket.append(record)
+
+    # --- Cross-account waves (same payload from many fresh accounts) ---
+    if (SPAM_WAVE_ENABLED and not repeat and _is_wave_payload(payload_sig)
+            and _is_fresh_account(message.author, message.created_at)):
+        wave = shard.waves.add(message.guild.id, message.author, record, now)
+        if wave is not None:
+            await _action_spam_wave(message.guild, wave, now)
+            return True
+
+    reason = _spam_window_reason(bucket)
+    if reason is None:
+        if _window_needs_content_check(bucket):
+            _start_content_check(message.guild, message.author, key)
+        return False
 
-    # prune
-    window_start = now.timestamp() - SPAM_WINDOW_SECONDS
-    while bucket and bucket[0]["ts"].timestamp() < window_start:
-        bucket.popleft()
+    state.mark_action(key, now)
+    evidence = list(bucket)
+    state.drop(key)
 
+    await _enqueue_enforcement(message.guild, message.author, evidence, reason)
+    return True
+
+def _spam_window_reason(bucket):
+    """The enforcement reason if a user's window crosses the thresholds, else None."""
     if len(bucket) < SPAM_MIN_MESSAGES:
-        return False
+        return None
 
-    channels = {e["channel_id"] for e in bucket}
+    channels = {e.channel_id for e in bucket}
     if len(channels) < SPAM_MIN_CHANNELS:
-        return False
+        return None
 
     if SPAM_REQUIRE_DUPLICATE_PAYLOAD:
-        sigs = [e["payload_sig"] for e in bucket if e.get("payload_sig")]
+        sigs = [e.payload_sig for e in bucket if e.payload_sig]
         most_common = Counter(sigs).most_common(1)[0][1] if sigs else 0
         if most_common < SPAM_MIN_DUPLICATES:
-            return False
+            return None
 
-    _last_spam_action[key] = now
-
-    reason = (
+    return (
         f"Spam watchdog: {len(bucket)} msgs in {SPAM_WINDOW_SECONDS}s "
         f"across {len(channels)} channels"
         + (f", duplicate_payload={SPAM_MIN_DUPLICATES}+" if SPAM_REQUIRE_DUPLICATE_PAYLOAD else "")
     )
 
-    evidence = list(bucket)
-    bucket.clear()
+def _window_needs_content_check(bucket):
+    # Only the duplicate rule failed, and unhashed attachments could still turn out to be copies
+    return (SPAM_REQUIRE_DUPLICATE_PAYLOAD
+            and len(bucket) >= SPAM_MIN_MESSAGES
+            and len({e.channel_id for e in bucket}) >= SPAM_MIN_CHANNELS
+            and any(e.attachments for e in bucket))
+
+def _is_wave_payload(payload_sig):
+    # Files, or text that is more than a link; shared links and their previews are normal chat
+    for part in payload_sig.split(" || "):
+        if part.startswith("att:"):
+            return True
+        if part.startswith("txt:"):
+            text = part[4:]
+            if len(text) >= SPAM_WAVE_MIN_TEXT_LEN and not re.fullmatch(r"<?https?://\S+>?", text):
+                return True
+    return False
+
+def _is_fresh_account(author, now):
+    """Joined the guild or created the account within SPAM_WAVE_MAX_ACCOUNT_AGE_DAYS of now."""
+    limit = timedelta(days=SPAM_WAVE_MAX_ACCOUNT_AGE_DAYS)
+    joined_at = getattr(author, "joined_at", None)
+    created_at = getattr(author, "created_at", None)
+    return any(ts is not None and now - ts <= limit for ts in (joined_at, created_at))
+
+async def _action_spam_wave(guild: discord.Guild, wave, now):
+    # Action every account in the wave that hasn't been handled yet, all at once
+    shard = shard_state(guild)
+    state = shard.spam
+    recent = len(shard.waves.recent_authors(wave, now))
+    targets = []
+    for author, records in shard.waves.new_authors(wave, now):
+        key = (guild.id, author.id)
+        if state.cooling_down(key, now):
+            continue
+        state.mark_action(key, now)
+        state.drop(key)
+        targets.append((author, records))
 
-    await _ban_and_report_for_spam(message, evidence, reason)
-    return True
+    reason = (
+        f"Spam watchdog: same payload from {recent} new accounts "
+        f"in {SPAM_WAVE_WINDOW_SECONDS}s"
+    )
+    for author, records in targets:
+        await _enqueue_enforcement(guild, author, records, reason)
 
-def _text_contains_any(text: str, phrases: list[str]) -> bool:
-    t = _normalize_text(text)
-    return any(p in t for p in phrases)
+# Words and single punctuation marks; "d*m me" -> ["d", "*", "m", "me"]
+_PHRASE_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
 
-def _count_hits(text: str, phrases: list[str]) -> int:
-    t = _normalize_text(text)
-    return sum(1 for p in phrases if p in t)
+class PhraseMatcher:
+    """
+    Matches many phrases at once: a trie keyed by token, walked from every token of the
+    text in a single pass. Cost depends on the text, not on how many phrases there are,
+    and phrases only match whole words ("ai" doesn't fire inside "said"). Phrases of the
+    plural_groups also match with an "s" on their last word ("nfts" counts as "nft").
+    """
+    def __init__(self, groups: dict[str, list[str]], plural_groups=()):
+        self.trie = {}
+        for group, phrases in groups.items():
+            for phrase in phrases:
+                tokens = _PHRASE_TOKEN_RE.findall(phrase.lower())
+                variants = [tokens]
+                if group in plural_groups and tokens[-1].isalnum() and not tokens[-1].endswith("s"):
+                    variants.append(tokens[:-1] + [tokens[-1] + "s"])
+                for variant in variants:
+                    node = self.trie
+                    for token in variant:
+                        node = node.setdefault(token, {})
+                    # None can't be a token, so it marks where phrases end
+                    node.setdefault(None, []).append((group, phrase))
+
+    def matches(self, text: str) -> dict[str, set[str]]:
+        """Distinct phrases found in already normalized text, per group."""
+        found = {}
+        tokens = _PHRASE_TOKEN_RE.findall(text)
+        n = len(tokens)
+        for i in range(n):
+            node = self.trie.get(tokens[i])
+            j = i + 1
+            while node is not None:
+                for group, phrase in node.get(None, ()):
+                    found.setdefault(group, set()).add(phrase)
+                if j == n:
+                    break
+                node = node.get(tokens[j])
+                j += 1
+        return found
+
+def build_scam_pitch_matcher():
+    # Rebuild after changing SCAM_PITCH_PHRASES / SCAM_PITCH_KEYWORDS
+    global _scam_pitch_matcher
+    _scam_pitch_matcher = PhraseMatcher(
+        {"phrase": SCAM_PITCH_PHRASES, "keyword": SCAM_PITCH_KEYWORDS}, plural_groups=("keyword",))
+
+build_scam_pitch_matcher()
 
 def _lines_with_colon(text: str) -> int:
     # These scam pitches often have "Blockchain:", "AI:", "Fullstack:" etc.
@@ -876,12 +2986,14 @@ def _scam_pitch_score(message: discord.Message) -> int:
     if len(t) >= SCAM_PITCH_MIN_TEXT_LEN:
         score += 2
 
+    hits = _scam_pitch_matcher.matches(t)
+
     # Contains DM solicitation language
-    if _text_contains_any(t, SCAM_PITCH_PHRASES):
+    if hits.get("phrase"):
         score += 4
 
     # Lots of buzzwords
-    kw_hits = _count_hits(t, SCAM_PITCH_KEYWORDS)
+    kw_hits = len(hits.get("keyword", ()))
     if kw_hits >= 4:
         score += 3
     elif kw_hits >= 2:
@@ -908,5 +3020,177 @@ def _scam_pitch_allowed_in_channel(channel_id: int) -> bool:
     return channel_id in SCAM_PITCH_CHANNEL_ALLOWLIST
 
 
-# Run the bot
-client.run(config['bot_token'])
+# --- Warm restart snapshot ---
+# Watchdog windows, spam cooldowns, queued softbans and caches survive a restart: they are
+# written to a gzipped JSON snapshot periodically and on shutdown, and read back on startup.
+# Timestamps are stored as ages, since the monotonic clock starts over with the process.
+SNAPSHOT_INTERVAL_SECONDS = config.get("snapshot_interval_seconds", 300)  # 0 disables snapshots
+SNAPSHOT_VERSION = 1
+# Processes running different shards keep separate snapshots
+SNAPSHOT_PATH = os.path.join(
+    CACHE_FOLDER,
+    f"runtime_snapshot-shards-{SHARD_IDS[0]}-{SHARD_IDS[-1]}.json.gz" if SHARD_IDS else "runtime_snapshot.json.gz",
+)
+
+class _RestoredUser(discord.Object):
+    # A queued softban's target before the member cache knows them again
+    def __init__(self, id, name):
+        super().__init__(id=id)
+        self.name = name
+
+    def __str__(self):
+        return self.name
+
+def _records_to_json(records, now):
+    return [[now - e.ts, e.channel_id, e.message_id, e.payload_sig] for e in records]
+
+def _records_from_json(rows, now):
+    return [SpamRecord(now - age, channel_id, message_id, payload_sig) for age, channel_id, message_id, payload_sig in rows]
+
+def build_snapshot(with_enforcement=False) -> dict:
+    """
+    Queued softbans are only saved on shutdown (with_enforcement): a periodic checkpoint
+    would also hold jobs a worker runs moments later, and a crash would run them twice.
+    """
+    now = _monotonic_ms()
+    windows, actions, enforcement = [], [], []
+    for shard in _shard_states.values():
+        for (guild_id, user_id), bucket in shard.spam.recent_user_messages.items():
+            windows.append([guild_id, user_id, _records_to_json(bucket, now)])
+        for (guild_id, user_id), ts in shard.spam.last_spam_action.items():
+            actions.append([guild_id, user_id, now - ts])
+        if not with_enforcement:
+            continue
+        for guild, user, evidence, reason in shard.enforcement.pending.values():
+            enforcement.append([guild.id, user.id, str(user), reason, _records_to_json(evidence, now)])
+
+    decomp = None
+    if decomp_progress.fetched_at is not None:
+        decomp = [decomp_progress.value, time.monotonic() - decomp_progress.fetched_at]
+
+    return {
+        "version": SNAPSHOT_VERSION,
+        "saved_at": time.time(),
+        "spam_windows": windows,       # least recently active first, like the LRU itself
+        "spam_actions": actions,       # oldest first
+        "enforcement": enforcement,
+        "media_urls": [[path, url, expires_at, mtime_ns] for path, (url, expires_at, mtime_ns) in _media_url_cache.items()],
+        "decomp": decomp,
+        "command_misses": list(_command_misses.items()),
+    }
+
+def save_snapshot(snapshot: dict):
+    data = gzip.compress(json.dumps(snapshot, separators=(",", ":")).encode("utf-8"), compresslevel=6)
+    _write_file_atomic(SNAPSHOT_PATH, data)
+
+def load_snapshot():
+    try:
+        with gzip.open(SNAPSHOT_PATH, "rb") as f:
+            snapshot = json.loads(f.read())
+    except FileNotFoundError:
+        return None
+    except (OSError, EOFError, ValueError) as e:
+        print(f"Ignoring unreadable snapshot {SNAPSHOT_PATH}: {e}")
+        return None
+    if snapshot.get("version") != SNAPSHOT_VERSION:
+        return None
+    return snapshot
+
+async def restore_snapshot(snapshot: dict):
+    """Put a snapshot's still-live entries back; anything already tracked since startup wins."""
+    now = _monotonic_ms()
+    downtime_ms = max(0, round((time.time() - snapshot["saved_at"]) * 1000))
+    window_ms = SPAM_WINDOW_SECONDS * 1000
+    cooldown_ms = SPAM_ACTION_COOLDOWN_SECONDS * 1000
+    restored = Counter()
+
+    live = {}  # id(state) -> (state, cooldown keys, window keys) tracked before the restore
+    def spam_state_for(guild):
+        state = shard_state(guild).spam
+        if id(state) not in live:
+            live[id(state)] = (state, list(state.last_spam_action), list(state.recent_user_messages))
+        return state
+
+    for guild_id, user_id, age in snapshot["spam_actions"]:
+        guild = client.get_guild(guild_id)
+        age += downtime_ms
+        if guild is None or age >= cooldown_ms:
+            continue
+        actions = spam_state_for(guild).last_spam_action
+        if (guild_id, user_id) not in actions:
+            actions[(guild_id, user_id)] = now - age
+            restored["cooldowns"] += 1
+
+    for guild_id, user_id, rows in snapshot["spam_windows"]:
+        guild = client.get_guild(guild_id)
+        rows = [[age + downtime_ms, *rest] for age, *rest in rows if age + downtime_ms < window_ms]
+        if guild is None or not rows:
+            continue
+        state = spam_state_for(guild)
+        key = (guild_id, user_id)
+        if key in state.recent_user_messages:
+            continue
+        state.window(key, now).extend(_records_from_json(rows, now))
+        restored["windows"] += 1
+
+    # Live entries are newer than anything restored; keep both dicts ordered oldest first
+    for state, action_keys, window_keys in live.values():
+        for key in action_keys:
+            state.last_spam_action[key] = state.last_spam_action.pop(key)
+        for key in window_keys:
+            state.recent_user_messages.move_to_end(key)
+
+    # A softban whose newest evidence is past the action cooldown is stale; the account was
+    # dealt with or has moved on
+    for guild_id, user_id, name, reason, rows in snapshot["enforcement"]:
+        guild = client.get_guild(guild_id)
+        rows = [[age + downtime_ms, *rest] for age, *rest in rows]
+        if guild is None or not rows or min(age for age, *_ in rows) >= cooldown_ms:
+            continue
+        user = guild.get_member(user_id) or _RestoredUser(user_id, name)
+        await _enqueue_enforcement(guild, user, _records_from_json(rows, now), reason)
+        restored["queued softbans"] += 1
+
+    wall_now = time.time()
+    for path, url, expires_at, mtime_ns in snapshot["media_urls"]:
+        if expires_at > wall_now and path not in _media_url_cache:
+            _media_url_cache[path] = (url, expires_at, mtime_ns)
+            restored["media urls"] += 1
+
+    # An old value is still served at once and refreshed in the background
+    if snapshot["decomp"] is not None and decomp_progress.fetched_at is None:
+        value, age = snapshot["decomp"]
+        decomp_progress.value = value
+        decomp_progress.fetched_at = time.monotonic() - age - downtime_ms / 1000
+        restored["decomp progress"] += 1
+
+    for name, count in snapshot.get("command_misses", []):
+        _command_misses[name] += count
+    if _command_misses:
+        restored["unknown commands"] = len(_command_misses)
+
+    print(f"Restored snapshot ({downtime_ms / 1000:.0f}s old): "
+          + (", ".join(f"{count} {what}" for what, count in restored.items()) or "nothing still live"))
+
+@tasks.loop(seconds=max(SNAPSHOT_INTERVAL_SECONDS, 1))
+async def checkpoint_snapshot():
+    try:
+        await asyncio.to_thread(save_snapshot, build_snapshot())
+    except OSError as e:
+        print(f"Failed to write snapshot: {e}")
+
+
+# Run the bot (replay_watchdog.py imports this module without connecting)
+if __name__ == "__main__":
+    client.run(config['bot_token'])
+    # client.run returns once the client is closed (SIGTERM, Ctrl+C); the state is still in memory
+    if SNAPSHOT_INTERVAL_SECONDS > 0:
+        try:
+            save_snapshot(build_snapshot(with_enforcement=True))
+        except OSError as e:
+            print(f"Failed to write snapshot: {e}")
+    if USAGE_FLUSH_SECONDS > 0 and _usage_pending:
+        try:
+            _write_usage(_take_usage_batch(), datetime.now(timezone.utc).date().isoformat())
+        except sqlite3.Error as e:
+            print(f"Failed to write trigger usage: {e}")
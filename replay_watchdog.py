@@ -0,0 +1,275 @@
+"""
+Replay a recorded message stream through the spam watchdog, offline.
+
+Each line of the input is one JSON message:
+
+    {"ts": 1718000000.5, "author": 123, "channel": 456, "content": "...",
+     "attachments": [{"filename": "a.png", "size": 1234, "content_type": "image/png", "hash": "..."}],
+     "spam": true}
+
+ts is in seconds (or an ISO 8601 string). Optional keys: guild, author_name, bot, staff,
+member (false for users that left, which the scam pitch check skips), joined and created
+(when the member joined and the account was created, same format as ts; waves only count
+recent ones), and spam, the label used to count detections and false positives. An author counts as a spammer if any of
+their messages is labelled spam.
+
+Usage:
+    python replay_watchdog.py capture.jsonl
+    python replay_watchdog.py capture.jsonl --grid SPAM_MIN_MESSAGES=3,4 --grid SCAM_PITCH_MIN_SCORE=6,7,8
+    python replay_watchdog.py capture.jsonl --set SCAM_PITCH_KEYWORDS=@keywords.json
+
+Run it from the bot folder: it imports nhxinfobot (which reads config.json) but never connects.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import discord
+
+import nhxinfobot as bot
+
+# Settings that can be swept; anything else is rejected so a typo doesn't silently do nothing
+TUNABLE = [
+    "SPAM_WINDOW_SECONDS",
+    "SPAM_MIN_MESSAGES",
+    "SPAM_MIN_CHANNELS",
+    "SPAM_REQUIRE_DUPLICATE_PAYLOAD",
+    "SPAM_MIN_DUPLICATES",
+    "SPAM_ACTION_COOLDOWN_SECONDS",
+    "SPAM_WAVE_ENABLED",
+    "SPAM_WAVE_WINDOW_SECONDS",
+    "SPAM_WAVE_MIN_AUTHORS",
+    "SPAM_WAVE_MIN_CHANNELS",
+    "SPAM_WAVE_MAX_ACCOUNT_AGE_DAYS",
+    "SPAM_WAVE_MIN_TEXT_LEN",
+    "SCAM_PITCH_ENABLED",
+    "SCAM_PITCH_MIN_TEXT_LEN",
+    "SCAM_PITCH_MIN_SCORE",
+    "SCAM_PITCH_PHRASES",
+    "SCAM_PITCH_KEYWORDS",
+]
+
+# --- Fake Discord objects ---
+_NO_PERMS = SimpleNamespace(administrator=False, manage_guild=False, manage_messages=False,
+                            ban_members=False, kick_members=False)
+_STAFF_PERMS = SimpleNamespace(administrator=False, manage_guild=False, manage_messages=True,
+                               ban_members=False, kick_members=False)
+
+class ReplayMember(discord.Member):
+    # A Member as far as isinstance() is concerned, without any gateway state behind it
+    def __init__(self, user_id, name, is_bot, staff, joined_at, created_at):
+        self._replay = (user_id, name, is_bot, staff, joined_at, created_at)
+
+    id = property(lambda self: self._replay[0])
+    name = property(lambda self: self._replay[1])
+    bot = property(lambda self: self._replay[2])
+    guild_permissions = property(lambda self: _STAFF_PERMS if self._replay[3] else _NO_PERMS)
+    joined_at = property(lambda self: self._replay[4])
+    created_at = property(lambda self: self._replay[5])
+
+    def __str__(self):
+        return self.name
+
+    def __repr__(self):
+        return f"<ReplayMember id={self.id} name={self.name!r}>"
+
+class ReplayUser(SimpleNamespace):
+    # Not in the guild anymore: a plain User to the watchdog
+    def __str__(self):
+        return self.name
+
+def _parse_ts(value):
+    if isinstance(value, str):
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    return float(value)
+
+def _parse_datetime(value):
+    return None if value is None else datetime.fromtimestamp(_parse_ts(value), timezone.utc)
+
+def load_stream(path):
+    """Parse the capture once into (timestamp ms, fake message, is spam) tuples, in time order."""
+    guilds, channels, authors = {}, {}, {}
+    stream = []
+    with open(path, encoding="utf-8") as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                raw = json.loads(line)
+                ts = _parse_ts(raw["ts"])
+                author_id = int(raw["author"])
+                channel_id = int(raw["channel"])
+            except (ValueError, KeyError, TypeError) as e:
+                print(f"{path}:{lineno}: skipping bad record ({e!r})", file=sys.stderr)
+                continue
+
+            guild_id = int(raw.get("guild", 0))
+            guild = guilds.setdefault(guild_id, SimpleNamespace(id=guild_id))
+            channel = channels.setdefault(channel_id, SimpleNamespace(id=channel_id))
+            author = authors.get((guild_id, author_id))
+            if author is None:
+                name = raw.get("author_name") or str(author_id)
+                try:
+                    joined_at = _parse_datetime(raw.get("joined"))
+                    created_at = _parse_datetime(raw.get("created"))
+                except (ValueError, TypeError) as e:
+                    print(f"{path}:{lineno}: ignoring bad joined/created ({e!r})", file=sys.stderr)
+                    joined_at = created_at = None
+                if raw.get("member", True):
+                    author = ReplayMember(author_id, name, bool(raw.get("bot")), bool(raw.get("staff")),
+                                          joined_at, created_at)
+                else:
+                    author = ReplayUser(id=author_id, name=name, bot=bool(raw.get("bot")), created_at=created_at,
+                                        guild_permissions=_STAFF_PERMS if raw.get("staff") else _NO_PERMS)
+                authors[(guild_id, author_id)] = author
+
+            attachments = [
+                SimpleNamespace(id=(lineno << 8) + i, filename=a.get("filename", ""), size=int(a.get("size", 0)),
+                                content_type=a.get("content_type"), url=f"replay:{a['hash']}" if a.get("hash") else None)
+                for i, a in enumerate(raw.get("attachments", []))
+            ]
+            message = SimpleNamespace(id=lineno, guild=guild, channel=channel, author=author,
+                                      created_at=datetime.fromtimestamp(ts, timezone.utc),
+                                      content=raw.get("content") or "", attachments=attachments, embeds=[])
+            stream.append((round(ts * 1000), message, bool(raw.get("spam"))))
+
+    stream.sort(key=lambda item: item[0])
+    return stream
+
+# --- Replay ---
+async def _replay_hash_attachment(url):
+    # The capture's hash stands in for the download; without one, the metadata fallback
+    return url[len("replay:"):] if url else None
+
+def _apply(settings):
+    for name, value in settings.items():
+        setattr(bot, name, value)
+    bot.build_scam_pitch_matcher()
+
+async def replay(stream, settings):
+    """Run the stream through a fresh watchdog; returns (actioned author keys -> first reason, seconds)."""
+    _apply(settings)
+    bot._shard_states.clear()
+    bot._attachment_budget.clear()
+
+    actioned = {}
+
+    async def record_action(guild, user, evidence, reason):
+        actioned.setdefault((guild.id, user.id), reason)
+
+    clock = [0]
+    bot._monotonic_ms = lambda: clock[0]
+    bot._enqueue_enforcement = record_action
+    bot._hash_attachment_prefix = _replay_hash_attachment
+
+    # Attachment hashing runs in the background in the bot; here it finishes before the next message
+    checks = []
+    bot._start_content_check = lambda guild, author, key: checks.append(
+        bot._check_content_duplicates(guild, author, key))
+
+    started = time.perf_counter()
+    for ts, message, _ in stream:
+        clock[0] = ts
+        await bot.spam_watchdog(message)
+        while checks:
+            await checks.pop()
+    return actioned, time.perf_counter() - started
+
+def _score(stream, actioned):
+    spammers = {(m.guild.id, m.author.id) for _, m, spam in stream if spam}
+    tp = len(spammers & actioned.keys())
+    return tp, len(actioned) - tp, len(spammers) - tp
+
+def _format_value(value):
+    if isinstance(value, list):
+        return f"[{len(value)} items]"
+    return json.dumps(value)
+
+def _parse_setting(text, multiple):
+    """NAME=value (JSON, or @file.json); with multiple, a comma separated list of values."""
+    name, sep, value = text.partition("=")
+    if not sep or name not in TUNABLE:
+        raise argparse.ArgumentTypeError(f"expected NAME=value with NAME one of: {', '.join(TUNABLE)}")
+
+    def parse_one(v):
+        v = v.strip()
+        if v.startswith("@"):
+            with open(v[1:], encoding="utf-8") as f:
+                return json.load(f)
+        try:
+            return json.loads(v)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"{name}: {v!r} is not valid JSON")
+
+    if not multiple:
+        return name, parse_one(value)
+    # @files hold whole lists, so they can't be comma separated
+    parts = [value] if value.strip().startswith("@") else value.split(",")
+    return name, [parse_one(v) for v in parts]
+
+def pitch_score_histogram(stream):
+    """_scam_pitch_score of every text message, counted per score and label."""
+    counts = Counter()
+    for _, message, spam in stream:
+        if message.content:
+            counts[(bot._scam_pitch_score(message), spam)] += 1
+    return counts
+
+async def main(args):
+    stream = load_stream(args.capture)
+    if not stream:
+        print("No messages to replay.")
+        return
+
+    base = dict(args.set)
+    grid = dict(args.grid)
+    labelled = any(spam for _, _, spam in stream)
+    print(f"{len(stream)} messages, {len({(m.guild.id, m.author.id) for _, m, _ in stream})} authors"
+          + (f", {len({(m.guild.id, m.author.id) for _, m, spam in stream if spam})} labelled spammers" if labelled else ""))
+
+    if args.scores:
+        _apply(base)
+        print("\nScam pitch scores (messages):")
+        print(f"{'score':>5} {'spam':>6} {'other':>6}")
+        hist = pitch_score_histogram(stream)
+        for score in sorted({s for s, _ in hist}):
+            print(f"{score:>5} {hist[(score, True)]:>6} {hist[(score, False)]:>6}")
+
+    names = list(grid)
+    print()
+    print(" ".join(f"{n:>{max(len(n), 8)}}" for n in names)
+          + f" {'actioned':>8}" + (f" {'caught':>6} {'false+':>6} {'missed':>6}" if labelled else "") + f" {'msgs/s':>9}")
+    for combo in itertools.product(*(grid[n] for n in names)):
+        settings = {**base, **dict(zip(names, combo))}
+        actioned, elapsed = await replay(stream, settings)
+        row = " ".join(f"{_format_value(v):>{max(len(n), 8)}}" for n, v in zip(names, combo))
+        row += f" {len(actioned):>8}"
+        if labelled:
+            tp, fp, fn = _score(stream, actioned)
+            row += f" {tp:>6} {fp:>6} {fn:>6}"
+        row += f" {len(stream) / elapsed if elapsed else float('inf'):>9.0f}"
+        print(row)
+
+        if args.verbose:
+            for (guild_id, user_id), reason in actioned.items():
+                print(f"    {user_id}: {reason}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a JSONL message capture through the spam watchdog.")
+    parser.add_argument("capture", help="JSONL file, one message per line")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE",
+                        type=lambda t: _parse_setting(t, multiple=False),
+                        help="override a setting for every run (JSON value or @file.json)")
+    parser.add_argument("--grid", action="append", default=[], metavar="NAME=V1,V2,...",
+                        type=lambda t: _parse_setting(t, multiple=True),
+                        help="sweep a setting; every combination of the grids is replayed")
+    parser.add_argument("--scores", action="store_true", help="print the scam pitch score histogram")
+    parser.add_argument("-v", "--verbose", action="store_true", help="list actioned authors and why")
+    asyncio.run(main(parser.parse_args()))